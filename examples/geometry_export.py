@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Save the pixel index map of a detector once, so that CxiManager and
+## SkopiH5Manager can assemble images with `path_geom` and without psana.
+
+from hit_labeler.utils    import PsanaImg
+from hit_labeler.geometry import GeometryAssembler
+
+exp           = 'amo06516'
+run           = '102'
+mode          = 'idx'
+detector_name = 'Camp.0:pnCCD.0'
+
+psana_img = PsanaImg( exp           = exp,
+                      run           = run,
+                      mode          = mode,
+                      detector_name = detector_name, )
+
+geom = GeometryAssembler.from_psana(psana_img)
+geom.save(f"{exp}.r{int(run):04d}.geom.npz")
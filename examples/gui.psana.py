@@ -36,10 +36,12 @@ class ConfigData:
         self.kwargs = kwargs
         for k, v in kwargs.items(): setattr(self, k, v)
 
-config_data = ConfigData( path_csv = "/reg/data/ana03/scratch/cwang31/spi/labels/2022_0518_1827_35.auto.label.csv",
-                          username = os.environ.get('USER'),
-                          mode     = "idx",
-                          detector = "pnccdFront",
-                          seed     = 0, )
-
-run(config_data)
+# Worker processes started by num_procs re-import this script...
+if __name__ == "__main__":
+    config_data = ConfigData( path_csv = "/reg/data/ana03/scratch/cwang31/spi/labels/2022_0518_1827_35.auto.label.csv",
+                              username = os.environ.get('USER'),
+                              mode     = "idx",
+                              detector = "pnccdFront",
+                              seed     = 0, )
+
+    run(config_data)
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Calibrate the images listed in a psana label csv once and save them into a
+## local h5 file, which is then opened by `gui.materialized.py`.
+
+import os
+
+from hit_labeler.materialize import materialize
+
+
+class ConfigData:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        for k, v in kwargs.items(): setattr(self, k, v)
+
+
+if __name__ == "__main__":
+    config_data = ConfigData( path_csv  = "/reg/data/ana03/scratch/cwang31/spi/labels/2022_0518_1827_35.auto.label.csv",
+                              username  = os.environ.get('USER'),
+                              mode      = "idx",
+                              detector  = "pnccdFront",
+                              seed      = 0,
+                              num_procs = 8, )
+
+    materialize(config_data, "/reg/data/ana03/scratch/cwang31/spi/labels/2022_0518_1827_35.materialized.h5")
@@ -1,9 +1,12 @@
-from . import data, layout, window, utils
+from . import data, layout, window, utils, geometry, workers, materialize
 
 __all__ = [
             "data", 
             "layout", 
             "window", 
             "utils",
+            "geometry",
+            "workers",
+            "materialize",
 ]
 
@@ -2,25 +2,96 @@
 # -*- coding: utf-8 -*-
 
 import os
+import abc
 import csv
+import hashlib
 import h5py
 import numpy as np
-import random
+import bisect
+import threading
+from collections        import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools          import partial
 from datetime import datetime
 
-from hit_labeler.utils  import set_seed, PsanaImg
+from hit_labeler.geometry import GeometryAssembler
+from hit_labeler.workers  import PsanaWorkerPool
+from hit_labeler.utils    import set_seed, bin_mean, PsanaReaderCache, H5FilePool, FrameCache, FrameIndex, H5Manifest, PanelMosaic, Normalizer, memmap_h5_dataset, find_runs, LocalityScheduler, FrameStats, LabelIndex, LabelBuffer, StageTimer, LabelJournal, get_drc_cache
 
-class DataManager:
-    def __init__(self):
+class DataManager(abc.ABC):
+    def __init__(self, config_data = None):
         super().__init__()
 
+        # Imported variables...
+        self.h5_max_open      = getattr(config_data, 'h5_max_open'     , 16)
+        self.h5_rdcc_nbytes   = getattr(config_data, 'h5_rdcc_nbytes'  , 64 * 1024 ** 2)
+        self.prefetch_depth   = getattr(config_data, 'prefetch_depth'  , 4)
+        self.prefetch_workers = getattr(config_data, 'prefetch_workers', 1)
+        self.cache_nbytes     = getattr(config_data, 'cache_nbytes'    , 512 * 1024 ** 2)
+        self.norm_dtype       = getattr(config_data, 'norm_dtype'      , np.float32)
+        self.pyramid_bins     = getattr(config_data, 'pyramid_bins'    , (4,))
+        self.pyramid_min_size = getattr(config_data, 'pyramid_min_size', 512 * 512)
+        self.stats_percentiles = getattr(config_data, 'stats_percentiles', (1, 50, 99, 99.9))
+        self.level_percentiles = getattr(config_data, 'level_percentiles', (1, 99.9))
+        self.stats_batch_size  = getattr(config_data, 'stats_batch_size' , 32)
+        self.stats_build       = getattr(config_data, 'stats_build'      , True)
+        self.adu_per_photon    = getattr(config_data, 'adu_per_photon'   , 1.0)
+        self.grid_shape        = getattr(config_data, 'grid_shape'       , (8, 8))
+        self.grid_tile_size    = getattr(config_data, 'grid_tile_size'   , 128)
+        self.label_keys        = getattr(config_data, 'label_keys'       , {})
+        self.label_advance     = getattr(config_data, 'label_advance'    , True)
+        self.timing            = getattr(config_data, 'timing'           , True)
+        self.timing_window     = getattr(config_data, 'timing_window'    , 1000)
+        self.path_journal      = getattr(config_data, 'path_journal'     , None)
+        self.journal_compact   = getattr(config_data, 'journal_compact'  , 10000)
+
         # Internal variables...
-        self.res_dict       = {}
-        self.img_state_dict = {}
+        self.res_dict = {}
+
+        # Map labels to sorted indices, built from res_dict on first use...
+        self._label_index = None
+
+        # Journal and report label changes in batches...
+        self.label_buffer = LabelBuffer(sink = self.commit_labels)
+        self.journal      = None
 
         self.timestamp = self.get_timestamp()
 
-        self.state_random = [random.getstate(), np.random.get_state()]
+        # Seed of per-image random generators when no seed is configured...
+        self.seed_session = int(np.random.SeedSequence().entropy)
+
+        # Time each stage of decoding and displaying images...
+        self.timer = StageTimer(window = self.timing_window, enabled = self.timing)
+
+        # Share open read-only h5 handles across all reads...
+        self.h5_pool = H5FilePool(max_open = self.h5_max_open, rdcc_nbytes = self.h5_rdcc_nbytes, timer = self.timer)
+
+        # Keep recently decoded images, invalidated by any change of trans or panels...
+        self.frame_cache = FrameCache(max_nbytes = self.cache_nbytes)
+        self._trans      = None
+        self._panels     = None
+
+        # Keep per-frame statistics, built in the background and invalidated along with the cache...
+        self._frame_stats = None
+        self.stats_lock   = threading.Lock()
+        self.stats_thread = None
+        self.stats_stop   = threading.Event()
+
+        # Bin size of thumbnails in the grid view, chosen upon the first image shape...
+        self.thumbnail_bin = None
+
+        # Run other background work, e.g. pages of the grid view...
+        self.executor = None
+
+        # Share panel selection, stitching and normalization among managers...
+        self.mosaic     = PanelMosaic()
+        self.normalizer = Normalizer(dtype = self.norm_dtype)
+
+        # Decode neighbouring images in the background...
+        self.prefetcher = None
+        if self.prefetch_depth > 0:
+            self.prefetcher = FramePrefetcher(self.cache_pyramid, depth       = self.prefetch_depth,
+                                                                  num_workers = self.prefetch_workers)
 
         return None
 
@@ -32,16 +103,757 @@ class DataManager:
         return timestamp
 
 
-    def save_random_state(self):
-        self.state_random = (random.getstate(), np.random.get_state())
+    def get_seed(self):
+        seed = getattr(self, 'seed', None)
+
+        return self.seed_session if seed is None else seed
+
+
+    def get_rng(self, idx):
+        ''' Return a counter-based random generator derived from the seed and
+            idx only, so an image is augmented identically in every session and
+            in any thread without keeping per-image state.
+        '''
+        seed_seq = np.random.SeedSequence([self.get_seed(), int(idx)])
+
+        return np.random.Generator(np.random.Philox(seed_seq))
+
+
+    def apply_trans(self, img, idx):
+        ''' Apply any possible transformation.  A transform declaring
+            accepts_rng = True receives the random generator of idx.
+        '''
+        if self.trans is None: return img
+
+        with self.timer.time("trans"):
+            if getattr(self.trans, 'accepts_rng', False): img = self.trans(img, rng = self.get_rng(idx))
+            else                                        : img = self.trans(img)
+
+        return img
+
+
+    @property
+    def trans(self):
+        return self._trans
+
+
+    @trans.setter
+    def trans(self, trans):
+        self._trans = trans
+        self.invalidate_cache()
+
+
+    @property
+    def panels(self):
+        return self._panels
+
+
+    @panels.setter
+    def panels(self, panels):
+        self._panels = panels
+        self.invalidate_cache()
+
+
+    @property
+    def label_index(self):
+        if self._label_index is None:
+            self._label_index = LabelIndex.from_res_dict(self.res_dict, num_img = len(self.img_tag_list))
+
+        return self._label_index
+
+
+    def reset_label_index(self):
+        ''' Rebuild the label index upon the next use, e.g. after res_dict is
+            replaced.
+        '''
+        self._label_index = None
+
+        return None
+
+
+    def set_label(self, idx, label):
+        img_tag = self.img_tag_list[idx]
+
+        k = (idx, img_tag)
+        self.res_dict[k] = label
+
+        self.label_index.set(idx, label)
+        self.label_buffer.append(idx, img_tag, label)
 
         return None
 
 
-    def set_random_state(self):
-        state_random, state_numpy = self.state_random
-        random.setstate(state_random)
-        np.random.set_state(state_numpy)
+    def flush_labels(self):
+        self.label_buffer.flush()
+
+        return None
+
+
+    def commit_labels(self, change_list):
+        ''' Append a batch of label changes to the journal and report them.
+        '''
+        if self.journal is not None: self.journal.append(change_list)
+
+        self.report_labels(change_list)
+
+        return None
+
+
+    def get_journal_path(self):
+        ''' Return the journal of labels of the images listed in the source
+            file, kept in the local cache directory by default.
+        '''
+        if self.path_journal is not None: return self.path_journal
+
+        path_source = getattr(self, 'path_csv', None) or getattr(self, 'path_h5', None) or getattr(self, 'path_cxi', None)
+        if path_source is None: return None
+
+        path_source = os.path.abspath(path_source)
+        digest = hashlib.sha1(f"{path_source}|{getattr(self, 'username', None)}".encode()).hexdigest()[:12]
+
+        return os.path.join(get_drc_cache('journals'), f"{os.path.basename(path_source)}.{digest}.jsonl")
+
+
+    def open_journal(self):
+        ''' Open the label journal, return (snapshot, changes) left by an
+            earlier session.
+        '''
+        path_journal = self.get_journal_path()
+        if path_journal is None: return None, []
+
+        self.journal = LabelJournal(path_journal, compact_size = self.journal_compact)
+        snapshot, change_list = self.journal.load()
+        try:
+            self.journal.open()
+        except OSError:
+            print(f"Warning!!! Failed to open journal {path_journal}, labels are kept in memory only.")
+            self.journal = None
+
+        return snapshot, change_list
+
+
+    def replay_labels(self, change_list):
+        ''' Apply changes from the journal to res_dict without journaling them
+            again, skip those whose tag doesn't match the image.  Return the
+            number of changes applied.
+        '''
+        num_replay = 0
+        for idx, tag, label in change_list:
+            if not 0 <= idx < len(self.img_tag_list): continue
+
+            img_tag = self.img_tag_list[idx]
+            if tuple(img_tag) != tuple(tag): continue
+
+            self.res_dict[(idx, img_tag)] = label
+            num_replay += 1
+
+        self.reset_label_index()
+
+        return num_replay
+
+
+    def reset_journal(self, snapshot = None):
+        ''' Start the journal over from a snapshot holding all labels so far.
+        '''
+        if self.journal is None: return None
+
+        # Pending changes are part of the snapshot...
+        self.label_buffer.flush()
+        self.journal.reset(snapshot)
+
+        return None
+
+
+    def report_labels(self, change_list):
+        ''' Summarize a batch of label changes on stdout.
+        '''
+        count_dict = {}
+        for _, _, label in change_list: count_dict[label] = count_dict.get(label, 0) + 1
+
+        summary = ", ".join( f"{label}: {count}" for label, count in count_dict.items() )
+        print(f"{len(change_list)} labels applied, last to {change_list[-1][0]}, {change_list[-1][1]} ({summary}).")
+
+        return None
+
+
+    def invalidate_cache(self):
+        if self.prefetcher is not None: self.prefetcher.cancel_pending()
+        self.frame_cache.clear()
+
+        # Statistics change with trans, panels or the tag list...
+        self._frame_stats = None
+
+        # Thumbnails are binned again upon the next image shape...
+        self.thumbnail_bin = None
+
+        return None
+
+
+    @property
+    def frame_stats(self):
+        ''' Per-frame statistics, None unless stats_build is on or statistics
+            have been loaded.
+        '''
+        frame_stats = self._frame_stats
+        if frame_stats is not None or not self.stats_build: return frame_stats
+
+        with self.stats_lock:
+            if self._frame_stats is None: self._frame_stats = self.new_frame_stats()
+
+        return self._frame_stats
+
+
+    def new_frame_stats(self):
+        return FrameStats(len(self.img_tag_list), percentiles    = tuple(self.stats_percentiles) + tuple(self.level_percentiles or ()),
+                                                  adu_per_photon = self.adu_per_photon,
+                                                  tag            = self.get_stats_tag())
+
+
+    def get_stats_tag(self):
+        ''' Describe what the statistics depend on, a stored file only loads
+            when its tag matches.
+        '''
+        # The seed only matters to a transform taking a random generator...
+        seed = self.get_seed() if getattr(self.trans, 'accepts_rng', False) else None
+
+        return f"{getattr(self, 'MANAGER', '')}|{len(self.img_tag_list)}|{self.img_tag_list[:1]}|{self.panels}|{self.get_trans_tag()}|{seed}"
+
+
+    def get_trans_tag(self):
+        ''' Name the transform by where it is defined rather than by its repr,
+            which often holds a memory address.  A trans.cache_tag, e.g. a
+            version of its parameters, is appended when set.
+        '''
+        trans = self.trans
+        if trans is None: return None
+
+        # Name bound methods and functions by themselves, other objects by their class...
+        target = getattr(trans, '__func__', trans)
+        if not hasattr(target, '__qualname__'): target = type(target)
+        trans_tag = f"{target.__module__}.{target.__qualname__}"
+
+        cache_tag = getattr(trans, 'cache_tag', None)
+        if cache_tag is None: cache_tag = getattr(getattr(trans, '__self__', None), 'cache_tag', None)
+        if cache_tag is not None: trans_tag += f":{cache_tag}"
+
+        return trans_tag
+
+
+    def build_stats(self):
+        ''' Compute statistics of frames missing from the store in batches on a
+            background thread.
+        '''
+        if self.stats_thread is not None and self.stats_thread.is_alive(): return None
+
+        self.stats_stop.clear()
+        self.stats_thread = threading.Thread(target = self.run_stats, daemon = True)
+        self.stats_thread.start()
+
+        return None
+
+
+    def run_stats(self):
+        frame_stats = self.frame_stats
+        if frame_stats is None: return None
+
+        # Keep background reads out of the timing of displayed images...
+        idx_miss = frame_stats.get_missing()
+        with self.timer.pause():
+            for start in range(0, len(idx_miss), self.stats_batch_size):
+                # Stop once asked to, or once the store is invalidated...
+                if self.stats_stop.is_set() or self._frame_stats is not frame_stats: break
+
+                idx_list = idx_miss[start : start + self.stats_batch_size].tolist()
+                try:
+                    frame_stats.update(idx_list, self.prepare_imgs(idx_list))
+                except Exception as e:
+                    print(f"Warning!!! Stopped building frame statistics: {type(e).__name__}: {e}")
+                    break
+
+        return None
+
+
+    def stop_stats(self):
+        self.stats_stop.set()
+        if self.stats_thread is not None: self.stats_thread.join()
+        self.stats_thread = None
+
+        return None
+
+
+    def save_stats(self, path):
+        frame_stats = self.frame_stats
+        if frame_stats is not None: frame_stats.save(path)
+
+        return None
+
+
+    def load_stats(self, path):
+        ''' Replace the store by statistics from path, return True when they
+            match the current images.
+        '''
+        if not os.path.exists(path): return False
+
+        frame_stats = self.new_frame_stats()
+        if not frame_stats.load(path): return False
+
+        with self.stats_lock: self._frame_stats = frame_stats
+
+        return True
+
+
+    def get_levels(self, idx):
+        ''' Return display levels of idx in normalized units at the percentiles
+            level_percentiles, or (0, 1) before its statistics are known.
+        '''
+        frame_stats = self.frame_stats
+        stats_dict  = None if frame_stats is None else frame_stats.get(idx)
+
+        # Levels only hold when normalization uses the stored mean and std...
+        if stats_dict is None or self.level_percentiles is None or callable(getattr(self.trans, 'get_stats', None)): return 0, 1
+
+        q_lo, q_hi = self.level_percentiles
+        mean = stats_dict["mean"]
+        std  = stats_dict["std"] if stats_dict["std"] > 0 else 1.0
+        level_lo = (stats_dict[FrameStats.get_percentile_key(float(q_lo))] - mean) / std
+        level_hi = (stats_dict[FrameStats.get_percentile_key(float(q_hi))] - mean) / std
+        if not level_hi > level_lo: level_hi = level_lo + 1
+
+        return level_lo, level_hi
+
+
+    def get_cache_key(self, idx, bin_size = 1):
+        return (idx, id(self.trans)) if bin_size == 1 else (idx, id(self.trans), bin_size)
+
+
+    @abc.abstractmethod
+    def fetch_img(self, idx):
+        ''' Read and preprocess one image, implemented by each manager.
+        '''
+        raise NotImplementedError
+
+
+    def get_norm_stats(self, img, idx = None):
+        ''' Return (mean, std) from the transform when it provides them
+            through a get_stats(img) method, or from the statistics of frame
+            idx, or None to compute them from img.
+        '''
+        get_stats = getattr(self.trans, 'get_stats', None)
+        if callable(get_stats): return get_stats(img)
+        if idx is None: return None
+
+        frame_stats = self.frame_stats
+        if frame_stats is None: return None
+
+        return frame_stats.get_mean_std(idx)
+
+
+    def normalize_img(self, img, idx = None):
+        ''' Standardize img with the stats chosen by get_norm_stats.
+        '''
+        stats = self.get_norm_stats(img, idx)
+
+        # Overwrite img unless it is a buffer shared with later reads...
+        inplace = not self.mosaic.is_buffer(img)
+
+        with self.timer.time("normalize"): img = self.normalizer(img, stats = stats, inplace = inplace)
+
+        return img
+
+
+    def cache_img(self, idx):
+        key = self.get_cache_key(idx)
+
+        img = self.frame_cache.get(key)
+        if img is None:
+            with self.timer.time("fetch"): img = self.fetch_img(idx)
+            self.frame_cache.put(key, img)
+
+        return img
+
+
+    def get_img(self, idx):
+        img = self.cache_img(idx) if self.prefetcher is None else self.prefetcher.get(idx)[-1][1]
+
+        return img
+
+
+    def cache_pyramid(self, idx):
+        ''' Return [(bin_size, img), ...] from the coarsest level to the full
+            resolution image, caching every level.
+        '''
+        img = self.cache_img(idx)
+
+        img_pyramid = [(1, img)]
+        if img.size >= self.pyramid_min_size:
+            for bin_size in sorted(self.pyramid_bins):
+                if bin_size <= 1: continue
+
+                key = self.get_cache_key(idx, bin_size)
+                img_bin = self.frame_cache.get(key)
+                if img_bin is None:
+                    img_bin = bin_mean(img, bin_row = bin_size, bin_col = bin_size)
+                    self.frame_cache.put(key, img_bin)
+
+                img_pyramid.insert(0, (bin_size, img_bin))
+
+        return img_pyramid
+
+
+    def get_pyramid(self, idx):
+        img_pyramid = self.cache_pyramid(idx) if self.prefetcher is None else self.prefetcher.get(idx)
+
+        return img_pyramid
+
+
+    def request_pyramid(self, idx):
+        ''' Return a future of the pyramid of idx without waiting for it, it is
+            decoded ahead of prefetched images.  Without a prefetcher the future
+            is completed right away.
+        '''
+        if self.prefetcher is not None: return self.prefetcher.request(idx)
+
+        future = Future()
+        try:
+            future.set_result(self.cache_pyramid(idx))
+        except Exception as e:
+            future.set_exception(e)
+
+        return future
+
+
+    @abc.abstractmethod
+    def prepare_imgs(self, idx_list):
+        ''' Read and preprocess a stack of images before normalization with
+            as few reads as possible, implemented by each manager.
+        '''
+        raise NotImplementedError
+
+
+    def get_thumbnails(self, idx_list):
+        ''' Return thumbnails of idx_list binned to about grid_tile_size pixels
+            on the longer side, only reading missing images in one batch.
+        '''
+        thumbnail_list = [None] * len(idx_list)
+        if self.thumbnail_bin is not None:
+            thumbnail_list = [ self.frame_cache.get(self.get_cache_key(idx, self.thumbnail_bin)) for idx in idx_list ]
+
+        idx_miss_list = sorted(set( idx for idx, thumbnail in zip(idx_list, thumbnail_list) if thumbnail is None ))
+        if idx_miss_list:
+            # Reuse full images on hand, read the others without caching them...
+            img_dict = { idx : self.frame_cache.get(self.get_cache_key(idx)) for idx in idx_miss_list }
+            idx_read_list = [ idx for idx, img in img_dict.items() if img is None ]
+            if idx_read_list: img_dict.update(zip(idx_read_list, self.fetch_imgs(idx_read_list)))
+
+            # Choose the bin size upon the first image shape...
+            if self.thumbnail_bin is None: self.thumbnail_bin = max(1, -(-max(img_dict[idx_miss_list[0]].shape) // self.grid_tile_size))
+            bin_size = self.thumbnail_bin
+
+            thumbnail_miss_dict = {}
+            for idx, img in img_dict.items():
+                thumbnail = img.copy() if bin_size == 1 else bin_mean(img, bin_row = bin_size, bin_col = bin_size)
+                self.frame_cache.put(self.get_cache_key(idx, bin_size), thumbnail)
+                thumbnail_miss_dict[idx] = thumbnail
+
+            thumbnail_list = [ thumbnail_miss_dict[idx] if thumbnail is None else thumbnail for idx, thumbnail in zip(idx_list, thumbnail_list) ]
+
+        return thumbnail_list
+
+
+    def get_page(self, idx_page):
+        ''' Return indices of page idx_page of the grid view.
+        '''
+        num_tile = self.grid_shape[0] * self.grid_shape[1]
+
+        return list(range(idx_page * num_tile, min((idx_page + 1) * num_tile, len(self.img_tag_list))))
+
+
+    def submit(self, fn, *args):
+        ''' Run fn(*args) on a background thread apart from the one decoding
+            images to step through, and return its future.  It runs right away
+            when prefetching is disabled.
+        '''
+        if self.prefetcher is not None:
+            if self.executor is None: self.executor = ThreadPoolExecutor(max_workers = 1)
+
+            return self.executor.submit(fn, *args)
+
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+        return future
+
+
+    def prefetch_page(self, idx_page):
+        ''' Make thumbnails of page idx_page in the background.
+        '''
+        idx_list = self.get_page(idx_page)
+        if self.prefetcher is None or not idx_list: return None
+
+        self.submit(self.get_thumbnails, idx_list)
+
+        return None
+
+
+    def get_tile_levels(self, thumbnail_list):
+        ''' Return display levels shared by thumbnails at the percentiles
+            level_percentiles.
+        '''
+        if self.level_percentiles is None: return 0, 1
+
+        level_lo, level_hi = np.percentile(np.concatenate([ np.ravel(thumbnail) for thumbnail in thumbnail_list ]), self.level_percentiles)
+        if not level_hi > level_lo: level_hi = level_lo + 1
+
+        return level_lo, level_hi
+
+
+    def fetch_imgs(self, idx_list):
+        imgs = self.prepare_imgs(idx_list)
+
+        imgs = self.normalize_imgs(imgs, idx_list)
+
+        return imgs
+
+
+    def get_imgs(self, idx_list):
+        ''' Return a stack (N, H, W) of images, only reading those not cached.
+        '''
+        img_list = [ self.frame_cache.get(self.get_cache_key(idx)) for idx in idx_list ]
+
+        # Read all missing images in one batch...
+        idx_miss_list = sorted(set( idx for idx, img in zip(idx_list, img_list) if img is None ))
+        if idx_miss_list:
+            imgs_miss = self.fetch_imgs(idx_miss_list)
+            # Cache copies of rows, a view would keep the whole batch alive...
+            img_miss_dict = { idx : img.copy() for idx, img in zip(idx_miss_list, imgs_miss) }
+            for idx, img in img_miss_dict.items(): self.frame_cache.put(self.get_cache_key(idx), img)
+
+            img_list = [ img_miss_dict[idx] if img is None else img for idx, img in zip(idx_list, img_list) ]
+
+        return np.stack(img_list)
+
+
+    def read_grouped(self, idx_list, locate, read_slab):
+        ''' Read raw frames of idx_list with as few reads as possible.  locate
+            maps an index to (group, local index), e.g. a dataset in a file,
+            and read_slab(group, start, stop) reads consecutive local indices.
+        '''
+        # Group indices by the dataset they live in...
+        group_dict = OrderedDict()
+        for pos, idx in enumerate(idx_list):
+            group, idx_local = locate(idx)
+            group_dict.setdefault(group, []).append((idx_local, pos))
+
+        # The background statistics pass yields the h5 pool lock after each frame...
+        is_background = threading.current_thread() is self.stats_thread
+
+        # Read each run of consecutive local indices as one slab...
+        raw_list = [None] * len(idx_list)
+        for group, local_list in group_dict.items():
+            local_list.sort()
+            pos_dict = {}
+            for idx_local, pos in local_list: pos_dict.setdefault(idx_local, []).append(pos)
+
+            run_list = [ (idx_local, idx_local + 1) for idx_local in sorted(pos_dict) ] if is_background else find_runs(sorted(pos_dict))
+            for start, stop in run_list:
+                slab = read_slab(group, start, stop)
+                for idx_local in range(start, stop):
+                    for pos in pos_dict[idx_local]: raw_list[pos] = slab[idx_local - start]
+
+        return raw_list
+
+
+    def assemble_img(self, multipanel):
+        ''' Assemble one multipanel frame with psana_img.
+        '''
+        _placeholder_event_num = 0
+
+        with self.timer.time("assemble"): img = self.psana_img.get(_placeholder_event_num, multipanel)
+
+        return img
+
+
+    def assemble_imgs(self, multipanel_list):
+        ''' Assemble multipanel frames with psana_img, in one call when it is a
+            GeometryAssembler.
+        '''
+        assemble_batch = getattr(self.psana_img, 'assemble_batch', None)
+        if not callable(assemble_batch): return np.stack([ self.assemble_img(multipanel) for multipanel in multipanel_list ])
+
+        with self.timer.time("assemble"): imgs = assemble_batch(np.stack(multipanel_list))
+
+        return imgs
+
+
+    def apply_trans_batch(self, imgs, idx_list):
+        ''' Apply any possible transformation to a stack of images.  A transform
+            declaring batched = True is called once on the whole stack.
+        '''
+        if self.trans is None: return imgs
+
+        if getattr(self.trans, 'batched', False):
+            with self.timer.time("trans"):
+                if getattr(self.trans, 'accepts_rng', False): imgs = self.trans(imgs, rng = [ self.get_rng(idx) for idx in idx_list ])
+                else                                        : imgs = self.trans(imgs)
+
+            return imgs
+
+        return np.stack([ self.apply_trans(img, idx) for img, idx in zip(imgs, idx_list) ])
+
+
+    def normalize_imgs(self, imgs, idx_list = None):
+        ''' Standardize a stack of images with the same stats as normalize_img,
+            so both paths agree on the images they cache.
+        '''
+        if idx_list is None: idx_list = [None] * len(imgs)
+        stats_list = [ self.get_norm_stats(img, idx) for img, idx in zip(imgs, idx_list) ]
+
+        with self.timer.time("normalize"): imgs = self.normalizer.normalize_batch(imgs, stats_list = stats_list, inplace = True)
+
+        return imgs
+
+
+    def prefetch(self, idx, direction = 1, order = None):
+        ''' Decode images following idx along the stepping direction.  order
+            is the sorted sequence of indices being stepped through, or an
+            IndexFilter, and defaults to all images.
+        '''
+        if self.prefetcher is None: return None
+
+        if order is None: order = range(len(self.img_tag_list))
+        self.prefetcher.schedule(idx, direction, order, order_reads = self.order_reads)
+
+        return None
+
+
+    def order_reads(self, idx_list):
+        ''' Return idx_list in the order it is cheapest to read, managers with
+            a costly random access override it.
+        '''
+        return list(idx_list)
+
+
+    def close(self):
+        ''' Release resources held by the manager, e.g. open h5 handles.
+        '''
+        self.flush_labels()
+        if self.journal is not None:
+            self.journal.join()
+            self.journal.close()
+
+        if self.prefetcher is not None: self.prefetcher.shutdown()
+        if self.executor   is not None: self.executor.shutdown(wait = False)
+        self.stop_stats()
+        self.h5_pool.close_all()
+
+        return None
+
+
+
+
+class FramePrefetcher:
+    '''
+    It decodes images on a pool of worker threads ahead of the user, so that
+    stepping with N/P finds the next image ready.  Only work in flight is
+    tracked here, finished images are kept by the manager's frame cache.
+    '''
+
+    def __init__(self, fetch, depth = 4, num_workers = 1):
+        self.fetch = fetch
+        self.depth = depth
+
+        self.future_dict = {}
+        self.lock        = threading.RLock()
+        self.executor    = ThreadPoolExecutor(max_workers = num_workers)
+
+        return None
+
+
+    def submit(self, idx):
+        with self.lock:
+            future = self.future_dict.get(idx, None)
+            if future is None or future.cancelled():
+                future = self.executor.submit(self.fetch, idx)
+                self.future_dict[idx] = future
+                future.add_done_callback(partial(self.discard, idx))
+
+        return future
+
+
+    def discard(self, idx, future):
+        with self.lock:
+            if self.future_dict.get(idx, None) is future: del self.future_dict[idx]
+
+        return None
+
+
+    def cancel_pending(self, idx_keep_list = ()):
+        with self.lock:
+            for idx, future in list(self.future_dict.items()):
+                if idx not in idx_keep_list: future.cancel()
+
+        return None
+
+
+    def request(self, idx):
+        with self.lock: is_submitted = idx in self.future_dict
+
+        # Let the requested image jump the queue of prefetched ones...
+        if not is_submitted: self.cancel_pending()
+
+        return self.submit(idx)
+
+
+    def get(self, idx):
+        return self.request(idx).result()
+
+
+    def find_neighbors(self, idx, direction, order):
+        ''' Return up to depth indices next to idx in order along direction
+            with rollover on both ends.  idx itself doesn't have to be in order.
+        '''
+        # Let a filter step through its own indices...
+        if hasattr(order, 'find_neighbors'): return order.find_neighbors(idx, direction, self.depth)
+
+        num_order = len(order)
+        if num_order == 0: return []
+
+        # Locate idx in the sorted order...
+        pos   = bisect.bisect_left(order, idx)
+        is_on = pos < num_order and order[pos] == idx
+
+        idx_list = []
+        for k in range(1, self.depth + 1):
+            if direction > 0: pos_k = pos + k if is_on else pos + k - 1
+            else            : pos_k = pos - k
+            idx_k = order[pos_k % num_order]
+
+            # Stop once the order wraps around...
+            if idx_k == idx or idx_k in idx_list: break
+            idx_list.append(idx_k)
+
+        return idx_list
+
+
+    def schedule(self, idx, direction, order, order_reads = None):
+        idx_list = self.find_neighbors(idx, direction, order)
+
+        # Drop pending work that is no longer ahead of the user...
+        self.cancel_pending([idx] + idx_list)
+
+        # The nearest image is queued first, the others in the cheapest order to read...
+        if order_reads is not None and len(idx_list) > 2: idx_list = idx_list[:1] + order_reads(idx_list[1:])
+        for idx_next in idx_list: self.submit(idx_next)
+
+        return None
+
+
+    def shutdown(self):
+        self.cancel_pending()
+        self.executor.shutdown(wait = False)
 
         return None
 
@@ -110,19 +922,27 @@ class DataManager:
 class CxiManager(DataManager):
 
     def __init__(self, config_data):
-        super().__init__()
+        super().__init__(config_data)
 
         # Imported variables...
-        self.path_cxi  = getattr(config_data, 'path_cxi' , None)
-        self.username  = getattr(config_data, 'username' , None)
-        self.seed      = getattr(config_data, 'seed'     , None)
-        self.trans     = getattr(config_data, 'trans'    , None)
-        self.psana_img = getattr(config_data, 'psana_img', None)
+        self.path_cxi   = getattr(config_data, 'path_cxi'  , None)
+        self.username   = getattr(config_data, 'username'  , None)
+        self.seed       = getattr(config_data, 'seed'      , None)
+        self.trans      = getattr(config_data, 'trans'     , None)
+        self.psana_img  = getattr(config_data, 'psana_img' , None)
+        self.path_geom  = getattr(config_data, 'path_geom' , None)
+        self.use_memmap = getattr(config_data, 'use_memmap', True)
 
         # Internal variables...
         self.img_tag_list = []
         self.MANAGER = 'cxi'
 
+        # Memmaps of contiguous uncompressed datasets...
+        self.memmap_dict = {}
+
+        # Assemble images without psana...
+        if self.path_geom is not None: self.psana_img = GeometryAssembler.load(self.path_geom)
+
         set_seed(self.seed)
 
         self.load_cxi_handler()
@@ -131,46 +951,73 @@ class CxiManager(DataManager):
 
 
     def load_cxi_handler(self):
-        multipanel_list = []
-        with h5py.File(self.path_cxi, 'r') as fh:
+        multipanel_list = FrameIndex()
+        with self.h5_pool.lock:
+            fh = self.h5_pool.get(self.path_cxi)
             entry_list = sorted([ item for item in fh.keys() if item.startswith('entry_') ], key = lambda x: int(x.split('_')[1]))
             for entry in entry_list:
                 entry_value = fh.get(entry)
                 data_list = sorted([ item for item in entry_value.keys() if item.startswith('data_') ], key = lambda x: int(x.split('_')[1]))
                 for data in data_list:
                     key_data = f"{entry}/{data}/data"
-                    num_multipanel = fh.get(key_data).shape[0]
-                    multipanel_list.extend( ( key_data, i) for i in range(num_multipanel) )
+                    dataset  = fh.get(key_data)
+                    num_multipanel = dataset.shape[0]
+                    multipanel_list.append(key_data, num_multipanel)
+
+                    # Bypass HDF5 when the dataset is a plain slab in the file...
+                    if self.use_memmap:
+                        memmap = memmap_h5_dataset(self.path_cxi, dataset)
+                        if memmap is not None: self.memmap_dict[key_data] = memmap
 
         self.img_tag_list = multipanel_list
 
         return None
 
 
-    def get_img(self, idx):
+    def close(self):
+        self.memmap_dict.clear()
+
+        super().close()
+
+        return None
+
+
+    def fetch_img(self, idx):
         key_data, idx_data = self.img_tag_list[idx]
 
-        with h5py.File(self.path_cxi, 'r') as fh:
-            multipanel = fh.get(key_data)[idx_data]
+        memmap = self.memmap_dict.get(key_data, None)
+        if memmap is None: multipanel = self.h5_pool.read(self.path_cxi, key_data, idx_data)
+        else:
+            with self.timer.time("read"): multipanel = np.array(memmap[idx_data])
 
-        _placeholder_event_num = 0
-        img = self.psana_img.get(_placeholder_event_num, multipanel)
+        img = self.assemble_img(multipanel)
 
         # Apply any possible transformation...
-        if self.trans is not None: img = self.trans(img)
+        img = self.apply_trans(img, idx)
 
-        # Save random state...
-        # Might not be useful for this labeler
-        if not idx in self.img_state_dict:
-            self.save_random_state()
-            self.img_state_dict[idx] = self.state_random
+        img = self.normalize_img(img, idx)
+
+        return img
+
+
+    def read_slab(self, key_data, start, stop):
+        memmap = self.memmap_dict.get(key_data, None)
+        if memmap is None: multipanels = self.h5_pool.read(self.path_cxi, key_data, np.s_[start:stop])
         else:
-            self.state_random = self.img_state_dict[idx]
-            self.set_random_state()
+            with self.timer.time("read"): multipanels = np.array(memmap[start:stop])
 
-        img = (img - np.mean(img)) / np.std(img)
+        return multipanels
 
-        return img
+
+    def prepare_imgs(self, idx_list):
+        multipanel_list = self.read_grouped(idx_list, self.img_tag_list.__getitem__, self.read_slab)
+
+        imgs = self.assemble_imgs(multipanel_list)
+
+        # Apply any possible transformation...
+        imgs = self.apply_trans_batch(imgs, idx_list)
+
+        return imgs
 
 
 
@@ -178,7 +1025,7 @@ class CxiManager(DataManager):
 class PsanaManager(DataManager):
 
     def __init__(self, config_data):
-        super().__init__()
+        super().__init__(config_data)
 
         # Imported variables...
         self.path_csv = getattr(config_data, 'path_csv', None)
@@ -189,11 +1036,34 @@ class PsanaManager(DataManager):
         self.trans    = getattr(config_data, 'trans'   , None)
         self.panels   = getattr(config_data, 'panels'  , None)
 
+        # Scanning runs competes with displayed events for readers...
+        self.stats_build = getattr(config_data, 'stats_build', False)
+        self.max_readers   = getattr(config_data, 'max_readers'  , 4)
+        self.reader_class  = getattr(config_data, 'reader_class' , None)
+        self.drc_timestamp = getattr(config_data, 'drc_timestamp', None)
+        self.num_procs     = getattr(config_data, 'num_procs'    , 0)
+
         # Internal variables...
         self.img_tag_list = []
         self.MANAGER = 'psana'
 
-        self.psana_imgreader_dict = {}
+        # Open at most max_readers runs at once...
+        reader_kwargs = {} if self.drc_timestamp is None else { 'drc_cache' : self.drc_timestamp }
+        self.reader_cache = PsanaReaderCache(self.mode, self.detector, max_open      = self.max_readers,
+                                                                       reader_class  = self.reader_class,
+                                                                       reader_kwargs = reader_kwargs,
+                                                                       timer         = self.timer)
+
+        # Read events run by run regardless of the csv order...
+        self.scheduler = LocalityScheduler(self.get_event_tag)
+
+        # Read events in worker processes, each with its own readers...
+        self.worker_pool = None
+        if self.num_procs > 0:
+            self.worker_pool = PsanaWorkerPool(self.mode, self.detector, num_procs     = self.num_procs,
+                                                                         max_readers   = self.max_readers,
+                                                                         reader_class  = self.reader_class,
+                                                                         reader_kwargs = reader_kwargs)
         self.entry_list = []
 
         self.psana_mode = 'calib' if self.panels else 'image'
@@ -201,6 +1071,10 @@ class PsanaManager(DataManager):
             'image' : self.get_assemble,
             'calib' : self.get_mosaic,
         }
+        self.psana_process_img = {
+            'image' : self.process_assemble,
+            'calib' : self.process_mosaic,
+        }
 
         set_seed(self.seed)
 
@@ -235,67 +1109,70 @@ class PsanaManager(DataManager):
     def form_mosaic(self, imgs, **kwargs):
         ''' Stitch images in imgs to form a single mosaic.
         ''' 
-        # Get the size of each image...
-        size_y, size_x = imgs[0].shape
-
-        # Make room for stiching along y-axis...
-        img_mosaic = np.zeros((size_y * len(imgs), size_x), dtype = np.float32)
-
-        # Stiching...
-        for i, img in enumerate(imgs):
-            img_mosaic[i * size_y : i * size_y + size_y] = img 
+        with self.timer.time("assemble"): img_mosaic = self.mosaic.stitch(imgs)
 
         return img_mosaic
 
 
     def filter_panels(self, imgs, **kwargs):
-        imgs_filtered = imgs
-        if self.panels is not None:
-            imgs_filtered = [ imgs[i] for i in self.panels ]
+        return self.mosaic.select(imgs, self.panels)
 
-        return imgs_filtered
 
+    def read_event(self, idx, mode):
+        with self.timer.time("read"):
+            if self.worker_pool is not None: img = self.submit_event(idx, mode).result()
 
-    def get_panels(self, idx):
+            # Initiate image accessing layer on demand...
+            else: img = self.reader_cache.read(*self.get_event_tag(idx), mode = mode)
+
+        return img
+
+
+    def get_event_tag(self, idx):
         exp, run, event_num, label = self.entry_list[idx]
 
-        # Form a minimal basename to describe a dataset...
-        basename = (exp, run)
+        return exp, run, int(event_num)
 
-        # Initiate image accessing layer...
-        if not basename in self.psana_imgreader_dict:
-            psana_imgreader = PsanaImg(exp, run, self.mode, self.detector)
-            self.psana_imgreader_dict[basename] = psana_imgreader
 
-        imgs = self.psana_imgreader_dict[basename].get(int(event_num), mode = 'calib')
+    def submit_event(self, idx, mode):
+        ''' Request an event from the worker processes without waiting for it.
+        '''
+        return self.worker_pool.submit(*self.get_event_tag(idx), mode = mode)
 
-        # Filter images...
-        imgs = self.filter_panels(imgs)
 
-        # Apply any possible transformation...
-        if self.trans is not None: imgs = self.trans(imgs)
+    def close(self):
+        # Report what reading run by run saved...
+        stats = self.scheduler.get_stats()
+        if any(stats.values()):
+            print(f"Reordered reads avoided {stats['switch_avoided']} reader switches and {stats['seek_avoided']} backward seeks.")
 
-        return imgs
+        # Stop prefetching and background reads before closing the pool and readers...
+        super().close()
 
+        if self.worker_pool is not None: self.worker_pool.close()
+        self.reader_cache.close_all()
 
-    def get_mosaic(self, idx):
-        exp, run, event_num, label = self.entry_list[idx]
+        return None
+
+
+    def get_panels(self, idx):
+        imgs = self.read_event(idx, mode = 'calib')
 
-        # Form a minimal basename to describe a dataset...
-        basename = (exp, run)
+        # Filter images...
+        imgs = self.filter_panels(imgs)
 
-        # Initiate image accessing layer...
-        if not basename in self.psana_imgreader_dict:
-            psana_imgreader = PsanaImg(exp, run, self.mode, self.detector)
-            self.psana_imgreader_dict[basename] = psana_imgreader
+        # Apply any possible transformation...
+        imgs = self.apply_trans(imgs, idx)
 
-        imgs = self.psana_imgreader_dict[basename].get(int(event_num), mode = 'calib')
+        return imgs
 
+
+    def process_mosaic(self, imgs, idx):
         # Filter images...
         imgs = self.filter_panels(imgs)
 
         # Apply any possible transformation...
-        if self.trans is not None: imgs = self.trans(imgs)
+        imgs = self.apply_trans(imgs, idx)
 
         # Form a mosaic...
         img_mosaic = self.form_mosaic(imgs)
@@ -303,42 +1180,58 @@ class PsanaManager(DataManager):
         return img_mosaic
 
 
-    def get_assemble(self, idx):
-        exp, run, event_num, label = self.entry_list[idx]
-
-        # Form a minimal basename to describe a dataset...
-        basename = (exp, run)
+    def get_mosaic(self, idx):
+        imgs = self.read_event(idx, mode = 'calib')
 
-        # Initiate image accessing layer...
-        if not basename in self.psana_imgreader_dict:
-            psana_imgreader = PsanaImg(exp, run, self.mode, self.detector)
-            self.psana_imgreader_dict[basename] = psana_imgreader
+        return self.process_mosaic(imgs, idx)
 
-        img = self.psana_imgreader_dict[basename].get(int(event_num), mode = 'image')
 
+    def process_assemble(self, img, idx):
         # Apply any possible transformation...
-        if self.trans is not None: img = self.trans(img)
+        img = self.apply_trans(img, idx)
 
         return img
 
 
-    def get_img(self, idx):
+    def get_assemble(self, idx):
+        img = self.read_event(idx, mode = 'image')
+
+        return self.process_assemble(img, idx)
+
+
+    def fetch_img(self, idx):
         psana_mode = self.psana_mode
 
         img = self.psana_read_img[psana_mode](idx)
 
-        # Save random state...
-        # Might not be useful for this labeler
-        if not idx in self.img_state_dict:
-            self.save_random_state()
-            self.img_state_dict[idx] = self.state_random
+        img = self.normalize_img(img, idx)
+
+        return img
+
+
+    def prepare_imgs(self, idx_list):
+        ''' Return a stack of images before normalization.
+        '''
+        psana_mode = self.psana_mode
+
+        # Read in the cheapest order, then restore the requested one...
+        idx_read_list = self.order_reads(idx_list)
+
+        if self.worker_pool is None:
+            img_iter = ( self.psana_read_img[psana_mode](idx) for idx in idx_read_list )
         else:
-            self.state_random = self.img_state_dict[idx]
-            self.set_random_state()
+            # Let all workers prepare their events concurrently...
+            future_list = [ self.submit_event(idx, psana_mode) for idx in idx_read_list ]
+            img_iter    = ( self.psana_process_img[psana_mode](future.result(), idx) for idx, future in zip(idx_read_list, future_list) )
 
-        img = (img - np.mean(img)) / np.std(img)
+        # Copy mosaics out of the reused buffer...
+        img_dict = { idx : img.copy() if self.mosaic.is_buffer(img) else img for idx, img in zip(idx_read_list, img_iter) }
+
+        return np.stack([ img_dict[idx] for idx in idx_list ])
 
-        return img
+
+    def order_reads(self, idx_list):
+        return self.scheduler.order(idx_list)
 
 
 
@@ -346,7 +1239,7 @@ class PsanaManager(DataManager):
 class SkopiH5Manager(DataManager):
 
     def __init__(self, config_data):
-        super().__init__()
+        super().__init__(config_data)
 
         # Imported variables...
         self.path_csv  = getattr(config_data, 'path_csv' , None)
@@ -356,6 +1249,9 @@ class SkopiH5Manager(DataManager):
         self.seed      = getattr(config_data, 'seed'     , None)
         self.trans     = getattr(config_data, 'trans'    , None)
         self.psana_img = getattr(config_data, 'psana_img', None)
+        self.path_geom = getattr(config_data, 'path_geom', None)
+        self.path_manifest    = getattr(config_data, 'path_manifest'   , f"{self.path_csv}.manifest.json")
+        self.manifest_workers = getattr(config_data, 'manifest_workers', None)
 
         # Internal variables...
         self.img_tag_list = []
@@ -363,6 +1259,9 @@ class SkopiH5Manager(DataManager):
 
         self.KEY_TO_IMG = 'photons'
 
+        # Assemble images without psana...
+        if self.path_geom is not None: self.psana_img = GeometryAssembler.load(self.path_geom)
+
         set_seed(self.seed)
 
         self.load_skopih5_handler()
@@ -371,7 +1270,8 @@ class SkopiH5Manager(DataManager):
 
 
     def load_skopih5_handler(self):
-        counter = 0
+        # Read csv file of datasets...
+        entry_list = []
         with open(self.path_csv, 'r') as fh: 
             lines = csv.reader(fh)
             next(lines)
@@ -380,29 +1280,27 @@ class SkopiH5Manager(DataManager):
 
                 path_skopih5 = os.path.join(drc, fl_skopih5)
 
-                # Record number of image per skopi h5 file...
-                num_img = 0
-
-                # Read each h5 file...
-                with h5py.File(path_skopih5, 'r') as fh:
-                    img_dataset = fh.get(self.KEY_TO_IMG, None)
+                entry_list.append((path_skopih5, label))
 
-                    if img_dataset is not None:
-                        num_img = img_dataset.shape[0]
+        # Record number of image per skopi h5 file, only opening files that are new or modified...
+        manifest = H5Manifest(self.path_manifest, self.KEY_TO_IMG, num_workers = self.manifest_workers)
+        num_img_list = manifest.get_num_frames([ path_skopih5 for path_skopih5, _ in entry_list ])
 
-                # Construct a tag for each image...
-                img_tag_list = []
-                for idx_img in range(num_img):
-                    img_tag = (path_skopih5, idx_img)
+        counter = 0
+        for (path_skopih5, label), num_img in zip(entry_list, num_img_list):
+            # Construct a tag for each image...
+            img_tag_list = []
+            for idx_img in range(num_img):
+                img_tag = (path_skopih5, idx_img)
 
-                    img_tag_list.append(img_tag)
+                img_tag_list.append(img_tag)
 
-                    k = (counter, img_tag)
-                    self.res_dict[k] = label
+                k = (counter, img_tag)
+                self.res_dict[k] = label
 
-                    counter += 1
+                counter += 1
 
-                self.img_tag_list.extend(img_tag_list)
+            self.img_tag_list.extend(img_tag_list)
 
 
         return None
@@ -411,32 +1309,20 @@ class SkopiH5Manager(DataManager):
     def get_img_by_psana(self, idx):
         path_skopih5, idx_img = self.img_tag_list[idx]
 
-        with h5py.File(path_skopih5, 'r') as fh:
-            multipanel_list = fh.get(self.KEY_TO_IMG)
-            multipanel      = multipanel_list[idx_img]
+        multipanel = self.h5_pool.read(path_skopih5, self.KEY_TO_IMG, idx_img)
 
-        _placeholder_event_num = 0
-        img = self.psana_img.get(_placeholder_event_num, multipanel)
+        img = self.assemble_img(multipanel)
 
         # Apply any possible transformation...
-        if self.trans is not None: img = self.trans(img)
+        img = self.apply_trans(img, idx)
 
         return img
 
 
-    def get_img(self, idx):
+    def fetch_img(self, idx):
         img = self.get_mosaic(idx) if self.psana_img is None else self.get_img_by_psana(idx)
 
-        # Save random state...
-        # Might not be useful for this labeler
-        if not idx in self.img_state_dict:
-            self.save_random_state()
-            self.img_state_dict[idx] = self.state_random
-        else:
-            self.state_random = self.img_state_dict[idx]
-            self.set_random_state()
-
-        img = (img - np.mean(img)) / np.std(img)
+        img = self.normalize_img(img, idx)
 
         return img
 
@@ -444,41 +1330,126 @@ class SkopiH5Manager(DataManager):
     def form_mosaic(self, imgs, **kwargs):
         ''' Stitch images in imgs to form a single mosaic.
         ''' 
-        # Get the size of each image...
-        size_y, size_x = imgs[0].shape
-
-        # Make room for stiching along y-axis...
-        img_mosaic = np.zeros((size_y * len(imgs), size_x), dtype = np.float32)
-
-        # Stiching...
-        for i, img in enumerate(imgs):
-            img_mosaic[i * size_y : i * size_y + size_y] = img 
+        with self.timer.time("assemble"): img_mosaic = self.mosaic.stitch(imgs)
 
         return img_mosaic
 
 
     def filter_panels(self, imgs, **kwargs):
-        imgs_filtered = imgs
-        if self.panels is not None:
-            imgs_filtered = [ imgs[i] for i in self.panels ]
-
-        return imgs_filtered
+        return self.mosaic.select(imgs, self.panels)
 
 
     def get_mosaic(self, idx):
         path_skopih5, idx_img = self.img_tag_list[idx]
 
-        with h5py.File(path_skopih5, 'r') as fh:
-            img_dataset = fh.get(self.KEY_TO_IMG)
-            imgs = img_dataset[idx_img]
+        imgs = self.h5_pool.read(path_skopih5, self.KEY_TO_IMG, idx_img)
 
         # Filter images...
         imgs = self.filter_panels(imgs)
 
         # Apply any possible transformation...
-        if self.trans is not None: imgs = self.trans(imgs)
+        imgs = self.apply_trans(imgs, idx)
 
         # Form a mosaic...
         img_mosaic = self.form_mosaic(imgs)
 
         return img_mosaic
+
+
+    def read_slab(self, path_skopih5, start, stop):
+        return self.h5_pool.read(path_skopih5, self.KEY_TO_IMG, np.s_[start:stop])
+
+
+    def prepare_imgs(self, idx_list):
+        multipanel_list = self.read_grouped(idx_list, self.img_tag_list.__getitem__, self.read_slab)
+
+        if self.psana_img is None:
+            # Filter images...
+            imgs = self.mosaic.select_batch(np.stack(multipanel_list), self.panels)
+
+            # Apply any possible transformation...
+            imgs = self.apply_trans_batch(imgs, idx_list)
+
+            # Form mosaics...
+            with self.timer.time("assemble"): imgs = self.mosaic.stitch_batch(imgs)
+        else:
+            imgs = self.assemble_imgs(multipanel_list)
+
+            # Apply any possible transformation...
+            imgs = self.apply_trans_batch(imgs, idx_list)
+
+        return imgs
+
+
+
+
+class MaterializedManager(DataManager):
+    """
+    It opens an h5 file written by materialize.materialize, which holds the
+    calibrated images selected by a psana csv, so a labelling session needs
+    neither psana nor calibration.  Tags and labels are the same as those of
+    PsanaManager.
+    """
+
+    KEY_DATA = 'data'
+    KEY_TAGS = 'tags'
+
+    def __init__(self, config_data):
+        super().__init__(config_data)
+
+        # Imported variables...
+        self.path_h5  = getattr(config_data, 'path_h5' , None)
+        self.username = getattr(config_data, 'username', None)
+        self.seed     = getattr(config_data, 'seed'    , None)
+        self.trans    = getattr(config_data, 'trans'   , None)
+
+        # Internal variables...
+        self.img_tag_list = []
+        self.MANAGER = 'psana'
+
+        set_seed(self.seed)
+
+        self.load_materialized_handler()
+
+        return None
+
+
+    def load_materialized_handler(self):
+        with h5py.File(self.path_h5, 'r') as fh:
+            group = fh.get(self.KEY_TAGS)
+            exp_list       = group['exp'].asstr()[()].tolist()
+            run_list       = group['run'][()].tolist()
+            event_num_list = group['event_num'][()].tolist()
+            label_list     = group['label'].asstr()[()].tolist()
+
+        for i, tag_img in enumerate(zip(exp_list, run_list, event_num_list)):
+            self.img_tag_list.append(tag_img)
+
+            k = (i, tag_img)
+            self.res_dict[k] = label_list[i]
+
+        return None
+
+
+    def read_slab(self, key_data, start, stop):
+        return self.h5_pool.read(self.path_h5, key_data, np.s_[start:stop])
+
+
+    def fetch_img(self, idx):
+        img = self.h5_pool.read(self.path_h5, self.KEY_DATA, idx)
+
+        # Apply any possible transformation on top of the materialized one...
+        img = self.apply_trans(img, idx)
+
+        img = self.normalize_img(img, idx)
+
+        return img
+
+
+    def prepare_imgs(self, idx_list):
+        img_list = self.read_grouped(idx_list, lambda idx: (self.KEY_DATA, idx), self.read_slab)
+
+        # Apply any possible transformation on top of the materialized one...
+        imgs = self.apply_trans_batch(np.stack(img_list), idx_list)
+
+        return imgs
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+class GeometryAssembler:
+    """
+    It assembles multipanel frames into detector images with a pixel index map
+    extracted once from psana, so that assembling a frame is one vectorized
+    scatter and needs no live DataSource.  It offers the same get method as
+    PsanaImg, hence it can be passed as psana_img to CxiManager and
+    SkopiH5Manager.
+    """
+
+    def __init__(self, pixel_idx, shape, shape_panels = None):
+        # Position of each detector pixel in the flattened image...
+        self.pixel_idx    = np.ascontiguousarray(pixel_idx, dtype = np.intp).ravel()
+        self.shape        = tuple(int(i) for i in shape)
+        self.shape_panels = None if shape_panels is None else tuple(int(i) for i in shape_panels)
+
+        self.size = int(np.prod(self.shape))
+
+        assert self.pixel_idx.size == 0 or (0 <= self.pixel_idx.min() and self.pixel_idx.max() < self.size), \
+               "Pixel index map doesn't fit in the image shape!!!"
+
+
+    @classmethod
+    def from_xy(cls, ix, iy):
+        ''' Build the map from per-pixel row and column indices, as returned by
+            detector.indexes_xy in psana.
+        '''
+        ix = np.asarray(ix)
+        iy = np.asarray(iy)
+
+        shape     = (int(ix.max()) + 1, int(iy.max()) + 1)
+        pixel_idx = np.ravel_multi_index((ix.ravel(), iy.ravel()), shape)
+
+        return cls(pixel_idx, shape, shape_panels = ix.shape)
+
+
+    @classmethod
+    def from_psana(cls, psana_img, event_num = 0):
+        ''' Extract the map from a PsanaImg, the only step that needs psana.
+        '''
+        event  = psana_img.get_event(event_num)
+        ix, iy = psana_img.detector.indexes_xy(event)
+
+        return cls.from_xy(ix, iy)
+
+
+    def save(self, path_geom):
+        shape_panels = () if self.shape_panels is None else self.shape_panels
+        np.savez(path_geom, pixel_idx    = self.pixel_idx,
+                            shape        = np.asarray(self.shape),
+                            shape_panels = np.asarray(shape_panels))
+
+        return None
+
+
+    @classmethod
+    def load(cls, path_geom):
+        with np.load(path_geom) as npz:
+            shape_panels = tuple(npz['shape_panels'].tolist()) or None
+
+            return cls(npz['pixel_idx'], npz['shape'].tolist(), shape_panels = shape_panels)
+
+
+    def assemble(self, multipanel):
+        multipanel = np.asarray(multipanel)
+
+        img = np.zeros(self.size, dtype = multipanel.dtype)
+        img[self.pixel_idx] = multipanel.ravel()
+
+        return img.reshape(self.shape)
+
+
+    def assemble_batch(self, multipanels):
+        ''' Assemble a stack of frames (N, panels, H, W) into (N, *shape).
+        '''
+        multipanels = np.asarray(multipanels)
+        num_frame   = multipanels.shape[0]
+
+        imgs = np.zeros((num_frame, self.size), dtype = multipanels.dtype)
+        imgs[:, self.pixel_idx] = multipanels.reshape(num_frame, -1)
+
+        return imgs.reshape((num_frame,) + self.shape)
+
+
+    def get(self, event_num, multipanel = None, mode = "image"):
+        assert multipanel is not None, "A multipanel frame is required to assemble an image!!!"
+        assert mode == "image", f"Mode {mode} is not allowed!!!  Only 'image' is supported."
+
+        return self.assemble(multipanel)
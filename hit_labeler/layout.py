@@ -17,8 +17,11 @@ class MainLayout(QtGui.QWidget):
 
         self.btn_prev_img, self.btn_next_img, self.btn_label = self.config_button_img()
 
+        self.btn_prev_page, self.btn_next_page, self.btn_label_tile = self.config_button_grid()
+
         # Update images in child's class
-        self.viewer_img = self.config_image()
+        self.viewer_img  = self.config_image()
+        self.viewer_grid = self.config_grid()
 
         return None
 
@@ -26,8 +29,10 @@ class MainLayout(QtGui.QWidget):
     def config_dock(self):
         # Define Docks in main window...
         setup_dict = {
-            "ImgQry"       : (500, 300),
-            "ImgQryButton" : (1, 1),
+            "ImgQry"        : (500, 300),
+            "ImgQryButton"  : (1, 1),
+            "ImgGrid"       : (500, 300),
+            "ImgGridButton" : (1, 1),
         }
 
         # Instantiate docks...
@@ -39,6 +44,9 @@ class MainLayout(QtGui.QWidget):
 
         self.area.addDock(dock_dict["ImgQryButton"]  , "bottom", dock_dict["ImgQry"])
 
+        self.area.addDock(dock_dict["ImgGrid"]       , "right" , dock_dict["ImgQry"])
+        self.area.addDock(dock_dict["ImgGridButton"] , "bottom", dock_dict["ImgGrid"])
+
         # Hide titles...
         for v in dock_dict.values(): v.hideTitleBar()
 
@@ -78,6 +86,26 @@ class MainLayout(QtGui.QWidget):
         return btn_prev, btn_next, btn_label
 
 
+    def config_button_grid(self):
+        ''' Dock of ImgGrid pages through thumbnails and labels selected ones.
+        '''
+        # Biolerplate code to start widget config
+        wdgt = LayoutWidget()
+
+        # Set up buttons...
+        btn_prev  = QtGui.QPushButton('Prev page')
+        btn_next  = QtGui.QPushButton('Next page')
+        btn_label = QtGui.QPushButton('Label selected')
+
+        wdgt.addWidget(btn_prev , row = 0, col = 0)
+        wdgt.addWidget(btn_next , row = 0, col = 1)
+        wdgt.addWidget(btn_label, row = 0, col = 2)
+
+        self.dock_dict["ImgGridButton"].addWidget(wdgt)
+
+        return btn_prev, btn_next, btn_label
+
+
     def config_image(self):
         ''' Display image.
         '''
@@ -87,3 +115,14 @@ class MainLayout(QtGui.QWidget):
         self.dock_dict["ImgQry"].addWidget(wdgt)
 
         return wdgt
+
+
+    def config_grid(self):
+        ''' Display a page of thumbnails packed into one image.
+        '''
+        # Biolerplate code to start widget config
+        wdgt = ImageView(view = PlotItem())
+
+        self.dock_dict["ImgGrid"].addWidget(wdgt)
+
+        return wdgt
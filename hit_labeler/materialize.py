@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import h5py
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from hit_labeler.data  import PsanaManager, MaterializedManager
+from hit_labeler.utils import atomic_path
+
+KEY_DATA = MaterializedManager.KEY_DATA
+KEY_TAGS = MaterializedManager.KEY_TAGS
+
+
+def materialize(config_data, path_h5, batch_size       = 64,
+                                      compression      = 'gzip',
+                                      compression_opts = 4):
+    ''' Write the calibrated, optionally transformed images selected by the
+        psana csv in config_data into one chunked, compressed h5 file with the
+        tag table, so that MaterializedManager can open them without psana.
+
+        Images are decoded in the worker processes of PsanaManager when
+        config_data.num_procs > 0, while the previous batch is being written.
+    '''
+    data_manager = PsanaManager(config_data)
+
+    num_img = len(data_manager.img_tag_list)
+    assert num_img > 0, f"No image is listed in {data_manager.path_csv}!!!"
+
+    batch_list = [ range(i, min(i + batch_size, num_img)) for i in range(0, num_img, batch_size) ]
+
+    # Write into a temporary file, only complete files are visible...
+    try:
+        with atomic_path(path_h5) as path_tmp, h5py.File(path_tmp, 'w') as fh, ThreadPoolExecutor(max_workers = 1) as executor:
+            dataset = None
+
+            # Decode the next batch while the current one is written...
+            future = executor.submit(data_manager.prepare_imgs, batch_list[0])
+            for i, idx_list in enumerate(batch_list):
+                imgs = future.result()
+                if i + 1 < len(batch_list): future = executor.submit(data_manager.prepare_imgs, batch_list[i + 1])
+
+                # Create the dataset upon knowing the image shape...
+                if dataset is None:
+                    dataset = fh.create_dataset(KEY_DATA, shape            = (num_img,) + imgs.shape[1:],
+                                                          dtype            = imgs.dtype,
+                                                          chunks           = (1,) + imgs.shape[1:],
+                                                          compression      = compression,
+                                                          compression_opts = compression_opts)
+
+                dataset[idx_list.start : idx_list.stop] = imgs
+
+                print(f"{idx_list.stop}/{num_img} images are materialized.")
+
+            write_tags(fh, data_manager)
+
+            # Record how images were produced...
+            fh.attrs['path_csv']   = str(data_manager.path_csv)
+            fh.attrs['detector']   = str(data_manager.detector)
+            fh.attrs['psana_mode'] = data_manager.psana_mode
+            fh.attrs['panels']     = np.asarray(data_manager.panels if data_manager.panels is not None else [], dtype = np.int64)
+            fh.attrs['trans']      = repr(data_manager.trans)
+            fh.attrs['timestamp']  = data_manager.timestamp
+    finally:
+        data_manager.close()
+
+    return None
+
+
+def write_tags(fh, data_manager):
+    ''' Write (exp, run, event_num, label) of each image as columns.
+    '''
+    exp_list, run_list, event_num_list, label_list = [], [], [], []
+    for i, (exp, run, event_num) in enumerate(data_manager.img_tag_list):
+        exp_list.append(exp)
+        run_list.append(run)
+        event_num_list.append(event_num)
+        label_list.append(data_manager.res_dict.get((i, (exp, run, event_num)), ''))
+
+    group = fh.create_group(KEY_TAGS)
+    group.create_dataset('exp'      , data = np.array(exp_list, dtype = h5py.string_dtype()))
+    group.create_dataset('run'      , data = np.array(run_list, dtype = np.int64))
+    group.create_dataset('event_num', data = np.array(event_num_list, dtype = np.int64))
+    group.create_dataset('label'    , data = np.array(label_list, dtype = h5py.string_dtype()))
+
+    return None
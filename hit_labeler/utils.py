@@ -1,10 +1,29 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
+import abc
+import csv
+import json
+import math
+import time
 import random
+import bisect
+import operator
+import threading
+import h5py
 import numpy as np
 import skimage.measure as sm
-import psana
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+# psana is only needed to read LCLS runs...
+try:
+    import psana
+except ImportError:
+    psana = None
 
 def set_seed(seed):
     random.seed(seed)
@@ -119,32 +138,132 @@ def downsample(assem, bin_row=2, bin_col=2, mask=None):
 
 
 
+def bin_mean(img, bin_row = 2, bin_col = 2):
+    ''' Downsample the last two axes of img by the mean of bin_row x bin_col
+        blocks through reshapes, repeating edge pixels to fill partial
+        blocks.  Much cheaper than downsample, which also weighs a mask.
+    '''
+    num_row, num_col = img.shape[-2:]
+    pad_row = -num_row % bin_row
+    pad_col = -num_col % bin_col
+    if pad_row or pad_col: img = np.pad(img, [(0, 0)] * (img.ndim - 2) + [(0, pad_row), (0, pad_col)], mode = 'edge')
+    num_row, num_col = img.shape[-2:]
+
+    # Add up strided slices, which is faster than reducing over small axes...
+    img = img.reshape(img.shape[:-1] + (num_col // bin_col, bin_col))
+    img_col = img[..., 0].astype(np.float32)
+    for i in range(1, bin_col): img_col += img[..., i]
+
+    img_col = img_col.reshape(img_col.shape[:-2] + (num_row // bin_row, bin_row, num_col // bin_col))
+    img_bin = img_col[..., 0, :].copy()
+    for i in range(1, bin_row): img_bin += img_col[..., i, :]
+
+    img_bin *= 1.0 / (bin_row * bin_col)
+
+    return img_bin
+
+
+
+
+def get_drc_cache(name):
+    ''' Return the local cache directory of hit_labeler for name.
+    '''
+    drc_root = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+
+    return os.path.join(drc_root, 'hit_labeler', name)
+
+
+@contextmanager
+def atomic_path(path, suffix = ''):
+    ''' Yield a temporary path next to path, which replaces path when the
+        block exits without error and is removed otherwise.  suffix is kept
+        at the end, e.g. for np.save adding '.npy'.
+    '''
+    path_tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp{suffix}"
+    try:
+        yield path_tmp
+        os.replace(path_tmp, path)
+    finally:
+        if os.path.exists(path_tmp): os.remove(path_tmp)
+
+
+
+
 class PsanaImg:
     """
     It serves as an image accessing layer based on the data management system
     psana in LCLS.  
+
+    The timestamp table of a run is saved as a binary array in drc_cache the
+    first time the run is opened, and memory-mapped on later opens instead of
+    walking the run again.  A run can only grow, e.g. while it is still being
+    written, so the table is rebuilt once an event beyond its end is asked for.
     """
 
-    def __init__(self, exp, run, mode, detector_name):
+    TIMESTAMP_DTYPE = np.dtype([ ('time', '<u8'), ('fiducial', '<u4') ])
+
+    def __init__(self, exp, run, mode, detector_name, drc_cache = None):
+        if psana is None: raise ImportError("psana is required to read LCLS runs!!!")
 
         # Biolerplate code to access an image
         # Set up data source
         self.datasource_id = f"exp={exp}:run={run}:{mode}"
         self.datasource    = psana.DataSource( self.datasource_id )
         self.run_current   = next(self.datasource.runs())
-        self.timestamps    = self.run_current.times()
+
+        # Set up the timestamp table...
+        self.exp        = exp
+        self.run        = run
+        self.mode       = mode
+        self.drc_cache  = get_drc_cache('timestamps') if drc_cache is None else drc_cache
+        self.timestamps = self.load_timestamps(exp, run, mode)
 
         # Set up detector
         self.detector = psana.Detector(detector_name)
 
 
-    def get(self, event_num, multipanel = None, mode = "image"):
+    def load_timestamps(self, exp, run, mode, refresh = False):
+        path_timestamps = os.path.join(self.drc_cache, f"{exp}.r{int(run):04d}.{mode}.timestamps.npy")
+
+        # Reuse the table saved by a previous session...
+        if not refresh and os.path.exists(path_timestamps):
+            try:
+                return np.load(path_timestamps, mmap_mode = 'r')
+            except (OSError, ValueError):
+                print(f"Warning!!! Ignoring unreadable timestamp table {path_timestamps}.")
+
+        # Walk the run only once, then save the table atomically...
+        timestamps = np.array([ (t.time(), t.fiducial()) for t in self.run_current.times() ], dtype = self.TIMESTAMP_DTYPE)
+        try:
+            os.makedirs(self.drc_cache, exist_ok = True)
+            with atomic_path(path_timestamps, suffix = '.npy') as path_tmp:
+                np.save(path_tmp, timestamps)
+        except OSError:
+            print(f"Warning!!! Failed to save timestamp table {path_timestamps}.")
+
+        return timestamps
+
+
+    def get_event(self, event_num):
+        event_num = int(event_num)
+
+        # The run has grown since the table was saved...
+        if event_num >= len(self.timestamps):
+            self.timestamps = self.load_timestamps(self.exp, self.run, self.mode, refresh = True)
+
         # Fetch the timestamp according to event number...
-        timestamp = self.timestamps[int(event_num)]
+        record    = self.timestamps[event_num]
+        timestamp = psana.EventTime(int(record['time']), int(record['fiducial']))
 
         # Access each event based on timestamp...
         event = self.run_current.event(timestamp)
 
+        return event
+
+
+    def get(self, event_num, multipanel = None, mode = "image"):
+        event = self.get_event(event_num)
+
         # Only three modes are supported...
         assert mode in ("raw", "image", "calib"), f"Mode {mode} is not allowed!!!  Only 'raw' or 'image' are supported."
 
@@ -154,3 +273,1944 @@ class PsanaImg:
         img = read[mode](event) if multipanel is None else read[mode](event, multipanel)
 
         return img
+
+
+    def close(self):
+        # Drop references to psana objects so that they can be released...
+        self.detector    = None
+        self.timestamps  = None
+        self.run_current = None
+        self.datasource  = None
+
+        return None
+
+
+
+
+class PsanaReaderCache:
+    """
+    It keeps at most max_open image readers, one per (exp, run), and closes
+    the least recently used one when another run is opened.  The reader class
+    defaults to PsanaImg and can be replaced by any class with the same
+    constructor and get method, e.g. a stand-in without psana.
+    """
+
+    def __init__(self, mode, detector_name, max_open = 4, reader_class = None, reader_kwargs = None, timer = None):
+        self.mode          = mode
+        self.detector_name = detector_name
+        self.max_open      = max(1, int(max_open))
+        self.reader_class  = PsanaImg if reader_class is None else reader_class
+        self.reader_kwargs = {} if reader_kwargs is None else reader_kwargs
+        self.timer         = StageTimer(enabled = False) if timer is None else timer
+
+        # Most recently used readers are kept at the end...
+        self.reader_dict = OrderedDict()
+        self.lock        = threading.RLock()
+
+        # Seconds spent to open each reader...
+        self.open_time_dict = {}
+
+
+    def get(self, exp, run):
+        basename = (exp, run)
+
+        with self.lock:
+            reader = self.reader_dict.pop(basename, None)
+            if reader is None:
+                time_start = time.perf_counter()
+                with self.timer.time("open"):
+                    reader = self.reader_class(exp, run, self.mode, self.detector_name, **self.reader_kwargs)
+                self.open_time_dict[basename] = time.perf_counter() - time_start
+
+            self.reader_dict[basename] = reader
+
+            # Close least recently used readers...
+            while len(self.reader_dict) > self.max_open:
+                _, reader_old = self.reader_dict.popitem(last = False)
+                self.close_reader(reader_old)
+
+        return reader
+
+
+    def read(self, exp, run, event_num, mode = "image"):
+        ''' Read an event while holding the cache lock, so that no other thread
+            can close the reader in the middle of a read.
+        '''
+        with self.lock:
+            img = self.get(exp, run).get(event_num, mode = mode)
+
+        return img
+
+
+    def close_reader(self, reader):
+        close = getattr(reader, 'close', None)
+        if callable(close): close()
+
+        return None
+
+
+    def close_all(self):
+        with self.lock:
+            while self.reader_dict:
+                _, reader = self.reader_dict.popitem(last = False)
+                self.close_reader(reader)
+
+        return None
+
+
+    def __contains__(self, basename):
+        return basename in self.reader_dict
+
+
+    def __len__(self):
+        return len(self.reader_dict)
+
+
+
+
+class H5FilePool:
+    """
+    It keeps a bounded pool of read-only h5py file handles keyed by path.
+    Handles are evicted in LRU order once more than `max_open` files are open,
+    so that stepping through frames reuses warm handles and their raw chunk
+    cache instead of paying an open/close per frame.
+    """
+
+    def __init__(self, max_open = 16, rdcc_nbytes = 64 * 1024 ** 2, rdcc_nslots = None, timer = None):
+        self.max_open    = max(1, int(max_open))
+        self.rdcc_nbytes = rdcc_nbytes
+        self.rdcc_nslots = rdcc_nslots
+        self.timer       = StageTimer(enabled = False) if timer is None else timer
+
+        # Most recently used handles are kept at the end...
+        self.fh_dict = OrderedDict()
+        self.lock    = threading.RLock()
+
+
+    def open(self, path):
+        kwargs = { "rdcc_nbytes" : self.rdcc_nbytes }
+        if self.rdcc_nslots is not None: kwargs["rdcc_nslots"] = self.rdcc_nslots
+
+        return h5py.File(path, 'r', **kwargs)
+
+
+    def get(self, path):
+        with self.lock:
+            fh = self.fh_dict.pop(path, None)
+
+            # Reopen the file if it is new or has been closed elsewhere...
+            if fh is None or not fh.id.valid:
+                with self.timer.time("open"): fh = self.open(path)
+            self.fh_dict[path] = fh
+
+            # Evict least recently used handles...
+            while len(self.fh_dict) > self.max_open:
+                _, fh_old = self.fh_dict.popitem(last = False)
+                fh_old.close()
+
+        return fh
+
+
+    def read(self, path, key, selection = ()):
+        ''' Read a selection from a dataset while holding the pool lock, so
+            that no other thread can evict the handle in the middle of a read.
+        '''
+        with self.lock:
+            dataset = self.get(path)[key]
+            with self.timer.time("read"): data = dataset[selection]
+
+        return data
+
+
+    def close(self, path):
+        with self.lock:
+            fh = self.fh_dict.pop(path, None)
+            if fh is not None: fh.close()
+
+        return None
+
+
+    def close_all(self):
+        with self.lock:
+            while self.fh_dict:
+                _, fh = self.fh_dict.popitem(last = False)
+                fh.close()
+
+        return None
+
+
+    def __len__(self):
+        return len(self.fh_dict)
+
+
+
+
+class FrameCache:
+    """
+    It keeps decoded frames in LRU order under a byte budget rather than an
+    entry count, since frames from different detectors differ in size by
+    orders of magnitude.  Cached arrays are made read-only as they are shared
+    by every caller.
+    """
+
+    def __init__(self, max_nbytes = 512 * 1024 ** 2):
+        self.max_nbytes = max_nbytes
+        self.nbytes     = 0
+
+        # Most recently used frames are kept at the end...
+        self.frame_dict = OrderedDict()
+        self.lock       = threading.Lock()
+
+        # Counters...
+        self.num_hit   = 0
+        self.num_miss  = 0
+        self.num_evict = 0
+
+
+    def get(self, key):
+        with self.lock:
+            frame = self.frame_dict.get(key, None)
+            if frame is None:
+                self.num_miss += 1
+            else:
+                self.num_hit += 1
+                self.frame_dict.move_to_end(key)
+
+        return frame
+
+
+    def put(self, key, frame):
+        nbytes = getattr(frame, 'nbytes', 0)
+
+        # Skip frames that would flush the whole cache...
+        if nbytes > self.max_nbytes: return None
+
+        if isinstance(frame, np.ndarray): frame.flags.writeable = False
+
+        with self.lock:
+            frame_old = self.frame_dict.pop(key, None)
+            if frame_old is not None: self.nbytes -= getattr(frame_old, 'nbytes', 0)
+
+            self.frame_dict[key] = frame
+            self.nbytes += nbytes
+
+            # Evict least recently used frames...
+            while self.nbytes > self.max_nbytes:
+                _, frame_old = self.frame_dict.popitem(last = False)
+                self.nbytes    -= getattr(frame_old, 'nbytes', 0)
+                self.num_evict += 1
+
+        return None
+
+
+    def clear(self):
+        with self.lock:
+            self.frame_dict.clear()
+            self.nbytes = 0
+
+        return None
+
+
+    def get_stats(self):
+        return { "hit"    : self.num_hit,
+                 "miss"   : self.num_miss,
+                 "evict"  : self.num_evict,
+                 "frames" : len(self.frame_dict),
+                 "nbytes" : self.nbytes, }
+
+
+    def __contains__(self, key):
+        return key in self.frame_dict
+
+
+    def __len__(self):
+        return len(self.frame_dict)
+
+
+
+
+class FrameIndex:
+    """
+    It behaves as a read-only sequence of (dataset key, local index) tags but
+    only stores one offset per dataset, so memory grows with the number of
+    datasets rather than the number of frames.  A global index is resolved to
+    its dataset by bisecting the offset table.
+    """
+
+    def __init__(self, key_list = (), num_list = ()):
+        self.key_list    = []
+        self.offset_list = [0]
+
+        for key, num in zip(key_list, num_list): self.append(key, num)
+
+
+    def append(self, key, num):
+        self.key_list.append(key)
+        self.offset_list.append(self.offset_list[-1] + int(num))
+
+        return None
+
+
+    def locate(self, idx):
+        ''' Return the position of the dataset holding idx and the local index.
+        '''
+        idx = operator.index(idx)
+
+        num_frame = len(self)
+        if idx < 0: idx += num_frame
+        if not 0 <= idx < num_frame: raise IndexError(f"Frame index {idx} is out of range!!!")
+
+        pos = bisect.bisect_right(self.offset_list, idx) - 1
+
+        return pos, idx - self.offset_list[pos]
+
+
+    def index(self, img_tag):
+        key, idx_local = img_tag
+
+        for pos, key_pos in enumerate(self.key_list):
+            num = self.offset_list[pos + 1] - self.offset_list[pos]
+            if key_pos == key and 0 <= idx_local < num: return self.offset_list[pos] + idx_local
+
+        raise ValueError(f"{img_tag} is not in the frame index!!!")
+
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice): return [ self[i] for i in range(*idx.indices(len(self))) ]
+
+        pos, idx_local = self.locate(idx)
+
+        return self.key_list[pos], idx_local
+
+
+    def __len__(self):
+        return self.offset_list[-1]
+
+
+    def __iter__(self):
+        for pos, key in enumerate(self.key_list):
+            num = self.offset_list[pos + 1] - self.offset_list[pos]
+            for idx_local in range(num): yield key, idx_local
+
+
+    def __contains__(self, img_tag):
+        try: self.index(img_tag)
+        except (ValueError, TypeError): return False
+
+        return True
+
+
+    def __repr__(self):
+        return f"FrameIndex(datasets = {len(self.key_list)}, frames = {len(self)})"
+
+
+
+
+def memmap_h5_dataset(path_h5, dataset):
+    ''' Return a read-only memmap of an h5 dataset stored contiguously without
+        filters, or None when the layout requires the HDF5 library to read it.
+    '''
+    if dataset.chunks is not None or dataset.size == 0: return None
+    if dataset.dtype.hasobject: return None
+
+    dcpl = dataset.id.get_create_plist()
+    if dcpl.get_nfilters() > 0 or dcpl.get_external_count() > 0: return None
+
+    # No offset means storage is not allocated in the file...
+    offset = dataset.id.get_offset()
+    if offset is None: return None
+
+    return np.memmap(path_h5, dtype = dataset.dtype, mode = 'r', offset = offset, shape = dataset.shape)
+
+
+def count_h5_frames(path_h5, key):
+    ''' Return the number of frames in the dataset key of a h5 file, or 0 if
+        the dataset doesn't exist.
+    '''
+    with h5py.File(path_h5, 'r') as fh:
+        dataset = fh.get(key, None)
+        num_frame = 0 if dataset is None else dataset.shape[0]
+
+    return num_frame
+
+
+
+
+class H5Manifest:
+    """
+    It caches the number of frames per h5 file in a sidecar json file.  Each
+    entry is validated against the file size and mtime, so only new or
+    modified files are opened again, and those are counted in parallel.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path_manifest, key, num_workers = None):
+        self.path_manifest = path_manifest
+        self.key           = key
+        self.num_workers   = num_workers or min(8, os.cpu_count() or 1)
+
+        # path -> [size, mtime_ns, num_frame]...
+        self.entry_dict = {}
+
+        self.load()
+
+
+    def load(self):
+        if not os.path.exists(self.path_manifest): return None
+
+        try:
+            with open(self.path_manifest, 'r') as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError):
+            print(f"Warning!!! Ignoring unreadable manifest {self.path_manifest}.")
+            return None
+
+        # Entries only hold when they are counted in the same way...
+        if manifest.get("version") == self.VERSION and manifest.get("key") == self.key:
+            self.entry_dict = manifest.get("files", {})
+
+        return None
+
+
+    def save(self):
+        manifest = { "version" : self.VERSION,
+                     "key"     : self.key,
+                     "files"   : self.entry_dict, }
+
+        try:
+            with atomic_path(self.path_manifest) as path_tmp, open(path_tmp, 'w') as fh:
+                json.dump(manifest, fh)
+        except OSError:
+            print(f"Warning!!! Failed to write manifest {self.path_manifest}.")
+
+        return None
+
+
+    def get_num_frames(self, path_list):
+        ''' Return the number of frames of each file in path_list.
+        '''
+        num_frame_dict = {}
+        stat_dict      = {}
+        path_stale_list = []
+        for path in path_list:
+            if path in stat_dict: continue
+
+            stat = os.stat(path)
+            stat_dict[path] = [stat.st_size, stat.st_mtime_ns]
+
+            entry = self.entry_dict.get(path, None)
+            if entry is not None and entry[:2] == stat_dict[path]:
+                num_frame_dict[path] = entry[2]
+            else:
+                path_stale_list.append(path)
+
+        # Count frames of new or modified files...
+        if path_stale_list:
+            key_list = [self.key] * len(path_stale_list)
+            if self.num_workers > 1 and len(path_stale_list) > 1:
+                with ProcessPoolExecutor(max_workers = self.num_workers) as executor:
+                    num_stale_list = list(executor.map(count_h5_frames, path_stale_list, key_list, chunksize = 16))
+            else:
+                num_stale_list = list(map(count_h5_frames, path_stale_list, key_list))
+
+            for path, num_frame in zip(path_stale_list, num_stale_list):
+                num_frame_dict[path]  = num_frame
+                self.entry_dict[path] = stat_dict[path] + [num_frame]
+
+            self.save()
+
+        return [ num_frame_dict[path] for path in path_list ]
+
+
+
+
+class PanelMosaic:
+    """
+    It selects detector panels and stitches them along y into one mosaic.  A
+    C-contiguous stack of panels is already laid out as a mosaic, so it is
+    returned as a reshaped view.  Any other input is stitched into a buffer
+    that is reused by each thread rather than allocated per call.
+    """
+
+    def __init__(self):
+        # (panels, selection) of the last call, swapped in one assignment...
+        self.selection_last = None
+
+        self.local = threading.local()
+
+
+    def get_selection(self, panels):
+        ''' Return a slice when panels are consecutive, otherwise an index array.
+        '''
+        panels = tuple(int(i) for i in panels)
+        selection_last = self.selection_last
+        if selection_last is not None and selection_last[0] == panels: return selection_last[1]
+
+        is_range  = len(panels) > 0 and panels == tuple(range(panels[0], panels[0] + len(panels))) and panels[0] >= 0
+        selection = slice(panels[0], panels[0] + len(panels)) if is_range else np.asarray(panels, dtype = np.intp)
+        self.selection_last = (panels, selection)
+
+        return selection
+
+
+    def select(self, imgs, panels = None):
+        if panels is None: return imgs
+
+        if isinstance(imgs, np.ndarray): return imgs[self.get_selection(panels)]
+
+        return [ imgs[i] for i in panels ]
+
+
+    def get_buffer(self, shape, dtype):
+        buffer_dict = getattr(self.local, "buffer_dict", None)
+        if buffer_dict is None:
+            buffer_dict = self.local.buffer_dict = {}
+
+        key = (shape, np.dtype(dtype))
+        if not key in buffer_dict: buffer_dict[key] = np.empty(shape, dtype = dtype)
+
+        return buffer_dict[key]
+
+
+    def is_buffer(self, img):
+        ''' Whether img is a reused buffer that must not be kept or modified.
+        '''
+        buffer_dict = getattr(self.local, "buffer_dict", {})
+
+        return any(img is buffer for buffer in buffer_dict.values())
+
+
+    def select_batch(self, imgs, panels = None):
+        ''' Select panels from a stack of multipanel frames (N, panels, H, W).
+        '''
+        if panels is None: return imgs
+
+        return imgs[:, self.get_selection(panels)]
+
+
+    def stitch_batch(self, imgs):
+        ''' Stitch a stack of multipanel frames into a stack of mosaics.
+        '''
+        imgs = np.ascontiguousarray(imgs)
+
+        return imgs.reshape(imgs.shape[0], -1, imgs.shape[-1])
+
+
+    def stitch(self, imgs):
+        # A contiguous stack of panels only needs a reshape...
+        if isinstance(imgs, np.ndarray) and imgs.ndim == 3 and imgs.flags.c_contiguous:
+            return imgs.reshape(-1, imgs.shape[-1])
+
+        # Get the size of each image...
+        size_y, size_x = imgs[0].shape
+
+        # Stitch along y-axis into the reused buffer...
+        img_mosaic = self.get_buffer((size_y * len(imgs), size_x), np.float32)
+        for i, img in enumerate(imgs):
+            img_mosaic[i * size_y : i * size_y + size_y] = img
+
+        return img_mosaic
+
+
+
+
+class Normalizer:
+    """
+    It standardizes a frame to zero mean and unit std in the output dtype,
+    float32 by default.  Mean and std are accumulated in float64 from the sum
+    and the sum of squares without creating temporary arrays, and the result
+    is written in place whenever the input can be overwritten.
+    """
+
+    def __init__(self, dtype = np.float32):
+        self.dtype = np.dtype(dtype)
+
+
+    def get_stats(self, img):
+        flat = np.ravel(img)
+        num  = flat.size
+        if num == 0: return 0.0, 1.0
+
+        sum_x  = float(np.add.reduce(flat, dtype = np.float64))
+        sum_x2 = float(np.einsum('i,i->', flat, flat, dtype = np.float64))
+
+        mean = sum_x / num
+        var  = max(sum_x2 / num - mean * mean, 0.0)
+
+        return mean, math.sqrt(var)
+
+
+    def can_overwrite(self, img):
+        return isinstance(img, np.ndarray) and img.dtype == self.dtype and img.flags.writeable
+
+
+    def __call__(self, img, stats = None, inplace = False):
+        ''' Normalize img with precomputed stats (mean, std) when available.
+        '''
+        mean, std = self.get_stats(img) if stats is None else stats
+
+        # Leave a flat image at zero instead of dividing by zero...
+        if not std > 0: std = 1.0
+
+        out = img if inplace and self.can_overwrite(img) else np.empty(np.shape(img), dtype = self.dtype)
+        np.subtract(img, mean, out = out, casting = 'unsafe')
+        np.multiply(out, 1.0 / std, out = out, casting = 'unsafe')
+
+        return out
+
+
+    def normalize_batch(self, imgs, stats_list = None, inplace = False):
+        ''' Normalize each frame of a stack (N, ...) with precomputed stats
+            (mean, std) in stats_list, or by its own mean and std where they
+            are None.
+        '''
+        if stats_list is None: stats_list = [None] * len(imgs)
+
+        mean = np.zeros(len(imgs), dtype = np.float64)
+        std  = np.ones (len(imgs), dtype = np.float64)
+
+        # Only scan frames without precomputed stats...
+        pos_list = [ pos for pos, stats in enumerate(stats_list) if stats is None ]
+        if pos_list:
+            flat = np.reshape(imgs, (len(imgs), -1))
+            if len(pos_list) < len(imgs): flat = flat[pos_list]
+            num  = max(flat.shape[1], 1)
+
+            sum_x  = np.add.reduce(flat, axis = 1, dtype = np.float64)
+            sum_x2 = np.einsum('ij,ij->i', flat, flat, dtype = np.float64)
+
+            mean[pos_list] = sum_x / num
+            std [pos_list] = np.sqrt(np.maximum(sum_x2 / num - mean[pos_list] * mean[pos_list], 0.0))
+
+        for pos, stats in enumerate(stats_list):
+            if stats is not None: mean[pos], std[pos] = stats
+
+        # Leave flat frames at zero instead of dividing by zero...
+        std[~(std > 0)] = 1.0
+
+        # Broadcast per-frame stats over the remaining axes...
+        shape_stats = (len(imgs),) + (1,) * (np.ndim(imgs) - 1)
+        mean = mean.reshape(shape_stats)
+        std  = std.reshape(shape_stats)
+
+        out = imgs if inplace and self.can_overwrite(imgs) else np.empty(np.shape(imgs), dtype = self.dtype)
+        np.subtract(imgs, mean, out = out, casting = 'unsafe')
+        np.multiply(out, 1.0 / std, out = out, casting = 'unsafe')
+
+        return out
+
+
+
+
+def find_runs(idx_list):
+    ''' Merge sorted unique indices into half-open runs [start, stop).
+    '''
+    run_list = []
+    for idx in idx_list:
+        if run_list and run_list[-1][1] == idx: run_list[-1][1] = idx + 1
+        else                                  : run_list.append([idx, idx + 1])
+
+    return [ tuple(run) for run in run_list ]
+
+
+
+
+
+class LocalityScheduler:
+    """
+    It reorders reads of psana events by (exp, run, event_num), so that
+    events are read run by run and forward within a run no matter how the csv
+    interleaves runs.  Sequence numbers shown to the user are untouched, only
+    the order of reads changes.  It counts the reader switches and backward
+    seeks saved compared with reading in the requested order.
+    """
+
+    def __init__(self, get_tag):
+        # idx -> (exp, run, event_num)...
+        self.get_tag = get_tag
+
+        self.num_switch_avoided = 0
+        self.num_seek_avoided   = 0
+        self.lock = threading.Lock()
+
+
+    @staticmethod
+    def count_cost(tag_list):
+        ''' Return the number of reader switches and backward seeks when
+            reading tag_list in order.
+        '''
+        num_switch = 0
+        num_seek   = 0
+        for (exp_prev, run_prev, event_prev), (exp, run, event) in zip(tag_list[:-1], tag_list[1:]):
+            if (exp, run) != (exp_prev, run_prev): num_switch += 1
+            elif event < event_prev              : num_seek   += 1
+
+        return num_switch, num_seek
+
+
+    @staticmethod
+    def get_sort_key(tag):
+        ''' Sort numeric runs by their value, e.g. run '9' before run '10',
+            and any other run after them by name.
+        '''
+        exp, run, event_num = tag
+        try:
+            run_key = (0, int(run), '')
+        except (TypeError, ValueError):
+            run_key = (1, 0, str(run))
+
+        return exp, run_key, event_num
+
+
+    def order(self, idx_list):
+        idx_list = list(idx_list)
+        tag_dict = { idx : self.get_tag(idx) for idx in idx_list }
+
+        idx_sorted_list = sorted(idx_list, key = lambda idx: self.get_sort_key(tag_dict[idx]))
+
+        # Keep track of what the new order saves...
+        num_switch, num_seek               = self.count_cost([ tag_dict[idx] for idx in idx_list ])
+        num_switch_sorted, num_seek_sorted = self.count_cost([ tag_dict[idx] for idx in idx_sorted_list ])
+        with self.lock:
+            self.num_switch_avoided += num_switch - num_switch_sorted
+            self.num_seek_avoided   += num_seek   - num_seek_sorted
+
+        return idx_sorted_list
+
+
+    def get_stats(self):
+        return { "switch_avoided" : self.num_switch_avoided,
+                 "seek_avoided"   : self.num_seek_avoided, }
+
+
+
+
+class FrameStats:
+    """
+    It keeps statistics of each frame before normalization in columns indexed
+    by the frame index: mean, std, min, max, selected percentiles and the
+    photon count.  Columns are filled in batches, e.g. by a background thread,
+    and frames not computed yet are marked in `valid`.  Values are computed in
+    float64 and stored in float32.  The store is saved as an npz file, which
+    only loads when its tag matches, e.g. the same frames under the same
+    transformation.
+    """
+
+    VERSION = 1
+
+    def __init__(self, num_img, percentiles = (1, 50, 99, 99.9), adu_per_photon = 1.0, tag = ''):
+        self.num_img        = num_img
+        self.percentiles    = tuple(sorted(set( float(q) for q in percentiles )))
+        self.adu_per_photon = adu_per_photon
+        self.tag            = tag
+
+        self.column_dict = OrderedDict( (key, np.full(num_img, np.nan, dtype = np.float32)) for key in self.get_keys() )
+        self.valid       = np.zeros(num_img, dtype = bool)
+        self.lock        = threading.Lock()
+
+
+    @staticmethod
+    def get_percentile_key(q):
+        return f"p{q:g}"
+
+
+    def get_keys(self):
+        return ["mean", "std", "min", "max"] + [ self.get_percentile_key(q) for q in self.percentiles ] + ["photons"]
+
+
+    def compute(self, imgs):
+        ''' Return { key : column } of a stack (N, ...) of frames.
+        '''
+        flat = np.reshape(imgs, (len(imgs), -1))
+        num  = max(flat.shape[1], 1)
+
+        # Accumulate in float64 just like Normalizer...
+        sum_x  = np.add.reduce(flat, axis = 1, dtype = np.float64)
+        sum_x2 = np.einsum('ij,ij->i', flat, flat, dtype = np.float64)
+        mean   = sum_x / num
+
+        column_dict = { "mean" : mean,
+                        "std"  : np.sqrt(np.maximum(sum_x2 / num - mean * mean, 0.0)),
+                        "min"  : flat.min(axis = 1),
+                        "max"  : flat.max(axis = 1), }
+
+        if self.percentiles:
+            for q, column in zip(self.percentiles, np.percentile(flat, self.percentiles, axis = 1)):
+                column_dict[self.get_percentile_key(q)] = column
+
+        # Count photons from positive pixels only...
+        sum_pos = np.add.reduce(flat, axis = 1, dtype = np.float64, where = flat > 0)
+        column_dict["photons"] = sum_pos / self.adu_per_photon
+
+        return column_dict
+
+
+    def update(self, idx_list, imgs):
+        idx_array   = np.asarray(idx_list, dtype = np.int64)
+        column_dict = self.compute(imgs)
+
+        with self.lock:
+            for key, column in column_dict.items(): self.column_dict[key][idx_array] = column
+            self.valid[idx_array] = True
+
+        return None
+
+
+    def get(self, idx):
+        ''' Return { key : value } of frame idx, or None before it is computed.
+        '''
+        if not self.valid[idx]: return None
+
+        return { key : float(column[idx]) for key, column in self.column_dict.items() }
+
+
+    def get_mean_std(self, idx):
+        if not self.valid[idx]: return None
+
+        return float(self.column_dict["mean"][idx]), float(self.column_dict["std"][idx])
+
+
+    def get_missing(self):
+        return np.flatnonzero(~self.valid)
+
+
+    def argsort(self, key, descending = False):
+        ''' Return indices of computed frames ordered by key.
+        '''
+        idx_valid = np.flatnonzero(self.valid)
+        order     = np.argsort(self.column_dict[key][idx_valid], kind = 'stable')
+        if descending: order = order[::-1]
+
+        return idx_valid[order]
+
+
+    def select(self, key, lo = -np.inf, hi = np.inf):
+        ''' Return sorted indices of computed frames with lo <= key <= hi.
+        '''
+        column = self.column_dict[key]
+
+        return np.flatnonzero(self.valid & (column >= lo) & (column <= hi))
+
+
+    def save(self, path):
+        with self.lock:
+            array_dict = { f"column_{key}" : column.copy() for key, column in self.column_dict.items() }
+            valid      = self.valid.copy()
+
+        try:
+            with atomic_path(path) as path_tmp, open(path_tmp, 'wb') as fh:
+                np.savez(fh, version     = self.VERSION,
+                             tag         = self.tag,
+                             percentiles = np.asarray(self.percentiles),
+                             valid       = valid,
+                             **array_dict)
+        except OSError:
+            print(f"Warning!!! Failed to write frame statistics {path}.")
+
+        return None
+
+
+    def load(self, path):
+        ''' Fill the store from path, return True when it matches this one.
+        '''
+        if not os.path.exists(path): return False
+
+        try:
+            with np.load(path) as npz:
+                is_match = ( int(npz["version"]) == self.VERSION       and
+                             str(npz["tag"])     == self.tag           and
+                             len(npz["valid"])   == self.num_img       and
+                             tuple(npz["percentiles"].tolist()) == self.percentiles )
+                if not is_match: return False
+
+                with self.lock:
+                    for key, column in self.column_dict.items(): column[...] = npz[f"column_{key}"]
+                    self.valid[...] = npz["valid"]
+        except (OSError, ValueError, KeyError):
+            print(f"Warning!!! Ignoring unreadable frame statistics {path}.")
+            return False
+
+        return True
+
+
+
+
+class IndexFilter(abc.ABC):
+    """
+    It steps through a subset of image indices with rollover on both ends.
+    An index outside the subset steps to its nearest neighbor in the subset.
+    Subclasses implement find_next and find_prev.
+    """
+
+    @abc.abstractmethod
+    def find_next(self, idx):
+        raise NotImplementedError
+
+
+    @abc.abstractmethod
+    def find_prev(self, idx):
+        raise NotImplementedError
+
+
+    def find_first(self):
+        return self.find_next(-1)
+
+
+    def find_neighbors(self, idx, direction, depth):
+        ''' Return up to depth indices next to idx along direction, so that it
+            can be passed as the order of FramePrefetcher.
+        '''
+        find = self.find_next if direction > 0 else self.find_prev
+
+        idx_list = []
+        idx_k    = idx
+        for _ in range(depth):
+            idx_k = find(idx_k)
+
+            # Stop once the subset wraps around...
+            if idx_k is None or idx_k == idx or idx_k in idx_list: break
+            idx_list.append(idx_k)
+
+        return idx_list
+
+
+
+
+class SortedFilter(IndexFilter):
+    """
+    It steps through a fixed sorted list of indices, e.g. frames selected by
+    their statistics.
+    """
+
+    def __init__(self, idx_list):
+        self.idx_list = sorted(idx_list)
+
+
+    def __len__(self):
+        return len(self.idx_list)
+
+
+    def find_next(self, idx):
+        if not self.idx_list: return None
+
+        pos = bisect.bisect_right(self.idx_list, idx)
+
+        return self.idx_list[pos] if pos < len(self.idx_list) else self.idx_list[0]
+
+
+    def find_prev(self, idx):
+        if not self.idx_list: return None
+
+        pos = bisect.bisect_left(self.idx_list, idx)
+
+        return self.idx_list[pos - 1] if pos > 0 else self.idx_list[-1]
+
+
+
+
+class LabelIndex:
+    """
+    It maps each image to a label code in an array, and each label to the
+    sorted indices of images having it.  Sorted indices of a label are only
+    gathered from the codes the first time the label is queried, then kept up
+    to date one label at a time, so filters on labels always see the latest
+    labels and never rescan all labels.
+    """
+
+    def __init__(self, num_img = 0, codes = None, vocab = ()):
+        self.num_img = num_img
+
+        # idx -> code into vocab, -1 for unlabeled images...
+        self.codes      = np.full(num_img, -1, dtype = np.int32) if codes is None else np.array(codes, dtype = np.int32)
+        self.vocab      = list(vocab)
+        self.vocab_dict = { label : code for code, label in enumerate(self.vocab) }
+
+        # label -> sorted indices, gathered on first use...
+        self.label_dict = {}
+
+        self.lock = threading.RLock()
+
+
+    @classmethod
+    def from_res_dict(cls, res_dict, num_img = 0):
+        ''' Build the index from res_dict keyed by (idx, tag).
+        '''
+        # Take over label codes when res_dict is columnar...
+        if isinstance(res_dict, LabelColumn):
+            codes, vocab = res_dict.get_codes()
+            return cls(num_img, codes = codes, vocab = vocab)
+
+        label_index = cls(num_img)
+        for (idx, _), label in res_dict.items(): label_index.set(int(idx), label)
+
+        return label_index
+
+
+    def get_code(self, label):
+        code = self.vocab_dict.get(label, None)
+        if code is None:
+            code = len(self.vocab)
+            self.vocab.append(label)
+            self.vocab_dict[label] = code
+
+        return code
+
+
+    def set(self, idx, label):
+        with self.lock:
+            # Make room for indices past the images known upon creation...
+            if idx >= len(self.codes): self.codes = np.concatenate([ self.codes, np.full(idx + 1 - len(self.codes), -1, dtype = np.int32) ])
+
+            code = self.get_code(label)
+            if self.codes[idx] == code: return None
+
+            self.discard(idx)
+
+            self.codes[idx] = code
+            idx_list = self.label_dict.get(label, None)
+            if idx_list is not None: bisect.insort(idx_list, idx)
+
+        return None
+
+
+    def discard(self, idx):
+        with self.lock:
+            label = self.get(idx)
+            if label is None: return None
+
+            self.codes[idx] = -1
+            idx_list = self.label_dict.get(label, None)
+            if idx_list is not None: del idx_list[bisect.bisect_left(idx_list, idx)]
+
+        return None
+
+
+    def get(self, idx):
+        if not 0 <= idx < len(self.codes): return None
+
+        code = self.codes[idx]
+
+        return self.vocab[code] if code >= 0 else None
+
+
+    def get_indices(self, label):
+        with self.lock:
+            idx_list = self.label_dict.get(label, None)
+            if idx_list is None:
+                code = self.vocab_dict.get(label, None)
+                idx_list = [] if code is None else np.flatnonzero(self.codes == code).tolist()
+                self.label_dict[label] = idx_list
+
+        return idx_list
+
+
+    def count(self):
+        ''' Return { label : number of images }.
+        '''
+        with self.lock:
+            codes = self.codes[self.codes >= 0]
+            num_list = np.bincount(codes, minlength = len(self.vocab)).tolist()
+
+        return { label : num for label, num in zip(self.vocab, num_list) if num > 0 }
+
+
+    def query(self, label_list, invert = False):
+        ''' Return a filter over images having any label in label_list, or
+            none of them when invert is True.
+        '''
+        return LabelFilter(self, label_list, invert = invert)
+
+
+
+
+class LabelFilter(IndexFilter):
+    """
+    It steps through images with any of the labels in label_list, or through
+    the complement when invert is True, by looking up a LabelIndex on every
+    step.  Labels added while the filter is on are taken into account.
+    """
+
+    def __init__(self, label_index, label_list, invert = False):
+        self.label_index = label_index
+        self.label_set   = set(label_list)
+        self.invert      = invert
+
+
+    def __contains__(self, idx):
+        return (self.label_index.get(idx) in self.label_set) != self.invert
+
+
+    def is_empty(self):
+        return self.find_first() is None
+
+
+    def find_next(self, idx):
+        label_index = self.label_index
+        with label_index.lock:
+            if self.invert: return self.scan(idx, 1)
+
+            # Take the nearest following index among all labels, or roll over to the smallest one...
+            idx_next_list  = []
+            idx_first_list = []
+            for label in self.label_set:
+                idx_list = label_index.get_indices(label)
+                if not idx_list: continue
+
+                pos = bisect.bisect_right(idx_list, idx)
+                if pos < len(idx_list): idx_next_list.append(idx_list[pos])
+                idx_first_list.append(idx_list[0])
+
+        if idx_next_list : return min(idx_next_list)
+        if idx_first_list: return min(idx_first_list)
+
+        return None
+
+
+    def find_prev(self, idx):
+        label_index = self.label_index
+        with label_index.lock:
+            if self.invert: return self.scan(idx, -1)
+
+            # Take the nearest preceding index among all labels, or roll over to the largest one...
+            idx_prev_list = []
+            idx_last_list = []
+            for label in self.label_set:
+                idx_list = label_index.get_indices(label)
+                if not idx_list: continue
+
+                pos = bisect.bisect_left(idx_list, idx)
+                if pos > 0: idx_prev_list.append(idx_list[pos - 1])
+                idx_last_list.append(idx_list[-1])
+
+        if idx_prev_list: return max(idx_prev_list)
+        if idx_last_list: return max(idx_last_list)
+
+        return None
+
+
+    def scan(self, idx, direction):
+        ''' Return the first index in the complement from idx along direction
+            with rollover.
+        '''
+        num_img = self.label_index.num_img
+        if num_img == 0: return None
+
+        start = idx + direction if 0 <= idx < num_img else (0 if direction > 0 else num_img - 1)
+        idx_free = self.skip_labeled(start, direction)
+        if idx_free is None: idx_free = self.skip_labeled(0 if direction > 0 else num_img - 1, direction)
+
+        return idx_free
+
+
+    def skip_labeled(self, idx, direction):
+        ''' Return the nearest index from idx along direction, idx included,
+            without a label in label_set, or None past the end.  Runs of
+            consecutive labeled indices are jumped over by bisection.
+        '''
+        num_img = self.label_index.num_img
+        while 0 <= idx < num_img:
+            is_moved = False
+            for label in self.label_set:
+                idx_list = self.label_index.get_indices(label)
+                pos = bisect.bisect_left(idx_list, idx)
+                if pos == len(idx_list) or idx_list[pos] != idx: continue
+
+                idx = idx_list[find_run_end(idx_list, pos)] + 1 if direction > 0 else idx_list[find_run_start(idx_list, pos)] - 1
+                is_moved = True
+
+            if not is_moved: return idx
+
+        return None
+
+
+
+
+def find_run_end(idx_list, pos):
+    ''' Return the last position of the run of consecutive indices through
+        pos in the sorted unique idx_list.
+    '''
+    # idx_list[j] - j never decreases and stays constant within a run...
+    offset = idx_list[pos] - pos
+    lo, hi = pos, len(idx_list) - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if idx_list[mid] - mid == offset: lo = mid
+        else                            : hi = mid - 1
+
+    return lo
+
+
+def find_run_start(idx_list, pos):
+    ''' Return the first position of the run of consecutive indices through
+        pos in the sorted unique idx_list.
+    '''
+    offset = idx_list[pos] - pos
+    lo, hi = 0, pos
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if idx_list[mid] - mid == offset: hi = mid
+        else                            : lo = mid + 1
+
+    return lo
+
+
+
+
+def pack_tiles(tile_list, pos_list, pad = 2, fill_value = 0.0):
+    ''' Pack equally sized 2d tiles into one atlas image, tile i goes to the
+        block at pos_list[i] = (block along axis 0, block along axis 1).
+        Return the atlas and the stride (size of a block with padding).
+    '''
+    size_0, size_1 = np.shape(tile_list[0])
+    stride = (size_0 + pad, size_1 + pad)
+
+    num_block_0 = max( pos[0] for pos in pos_list ) + 1
+    num_block_1 = max( pos[1] for pos in pos_list ) + 1
+    atlas = np.full((num_block_0 * stride[0] - pad, num_block_1 * stride[1] - pad), fill_value, dtype = np.float32)
+
+    for tile, (i, j) in zip(tile_list, pos_list):
+        atlas[i * stride[0] : i * stride[0] + size_0, j * stride[1] : j * stride[1] + size_1] = tile
+
+    return atlas, stride
+
+
+
+
+class LabelBuffer:
+    """
+    It collects label changes (idx, tag, label) and hands them to sink in
+    batches, when max_size changes are pending or upon flush, so labelling
+    doesn't write to stdout or disk for every image.
+    """
+
+    def __init__(self, sink = None, max_size = 256):
+        self.sink     = sink
+        self.max_size = max_size
+
+        self.change_list = []
+        self.lock        = threading.Lock()
+
+
+    def __len__(self):
+        return len(self.change_list)
+
+
+    def append(self, idx, tag, label):
+        with self.lock:
+            self.change_list.append((idx, tag, label))
+            is_full = len(self.change_list) >= self.max_size
+
+        if is_full: self.flush()
+
+        return None
+
+
+    def flush(self):
+        with self.lock:
+            change_list, self.change_list = self.change_list, []
+
+        if change_list and self.sink is not None: self.sink(change_list)
+
+        return change_list
+
+
+
+
+class StageTimer:
+    """
+    It records how long named stages take, e.g. open, read, assemble, trans,
+    normalize and setImage of each image.  Durations of each stage are kept
+    in a rolling window for percentiles, and the latest spans are kept with
+    their start time and thread for export as CSV or Chrome trace JSON.
+    A disabled timer records nothing, and neither does a thread within pause.
+    """
+
+    def __init__(self, window = 1000, max_span = 100000, enabled = True):
+        self.window  = window
+        self.enabled = enabled
+
+        # Threads that record nothing for now, e.g. background work...
+        self.local = threading.local()
+
+        # stage -> recent durations in seconds...
+        self.duration_dict = OrderedDict()
+
+        # (stage, start, duration, thread id)...
+        self.span_list = deque(maxlen = max_span)
+
+        self.time_origin = time.perf_counter()
+        self.lock        = threading.Lock()
+
+
+    def time(self, stage):
+        ''' Return a context manager timing stage.
+        '''
+        return StageSpan(self, stage) if self.enabled and not getattr(self.local, 'is_paused', False) else NULL_SPAN
+
+
+    @contextmanager
+    def pause(self):
+        ''' Record nothing from the calling thread within the context.
+        '''
+        is_paused = getattr(self.local, 'is_paused', False)
+        self.local.is_paused = True
+        try:
+            yield self
+        finally:
+            self.local.is_paused = is_paused
+
+
+    def record(self, stage, time_start, time_end):
+        duration = time_end - time_start
+        with self.lock:
+            duration_list = self.duration_dict.get(stage, None)
+            if duration_list is None: duration_list = self.duration_dict[stage] = deque(maxlen = self.window)
+            duration_list.append(duration)
+
+            self.span_list.append((stage, time_start - self.time_origin, duration, threading.get_ident()))
+
+        return None
+
+
+    def get_percentiles(self, percentiles = (50, 90, 99)):
+        ''' Return { stage : (count, [percentile in ms, ...]) } over the
+            rolling window.
+        '''
+        with self.lock:
+            duration_dict = { stage : np.array(duration_list) for stage, duration_list in self.duration_dict.items() }
+
+        return { stage : (len(duration_list), (np.percentile(duration_list, percentiles) * 1e3).tolist())
+                 for stage, duration_list in duration_dict.items() if len(duration_list) }
+
+
+    def summarize(self, percentiles = (50, 90, 99)):
+        ''' Return one line per stage, e.g. "read  p50 1.2  p90 ... ms".
+        '''
+        line_list = []
+        for stage, (count, value_list) in self.get_percentiles(percentiles).items():
+            value_str = "  ".join( f"p{q:g} {value:.1f}" for q, value in zip(percentiles, value_list) )
+            line_list.append(f"{stage:<10s} {value_str} ms (n = {count})")
+
+        return "\n".join(line_list)
+
+
+    def export_csv(self, path):
+        with self.lock: span_list = list(self.span_list)
+
+        with open(path, 'w') as fh:
+            csv_writer = csv.writer(fh)
+            csv_writer.writerow(["stage", "start_us", "duration_us", "thread"])
+            for stage, time_start, duration, thread in span_list:
+                csv_writer.writerow([stage, f"{time_start * 1e6:.1f}", f"{duration * 1e6:.1f}", thread])
+
+        return None
+
+
+    def export_trace(self, path):
+        ''' Write spans in the Chrome trace event format, to be opened in
+            chrome://tracing or Perfetto.
+        '''
+        with self.lock: span_list = list(self.span_list)
+
+        pid = os.getpid()
+        event_list = [ { "name" : stage, "ph" : "X", "ts" : time_start * 1e6, "dur" : duration * 1e6, "pid" : pid, "tid" : thread }
+                       for stage, time_start, duration, thread in span_list ]
+
+        with open(path, 'w') as fh:
+            json.dump({ "traceEvents" : event_list, "displayTimeUnit" : "ms" }, fh)
+
+        return None
+
+
+    def clear(self):
+        with self.lock:
+            self.duration_dict.clear()
+            self.span_list.clear()
+
+        return None
+
+
+
+
+class StageSpan:
+    """
+    It times one stage of a StageTimer as a context manager.
+    """
+
+    def __init__(self, timer, stage):
+        self.timer = timer
+        self.stage = stage
+
+
+    def __enter__(self):
+        self.time_start = time.perf_counter()
+
+        return self
+
+
+    def __exit__(self, *args):
+        self.timer.record(self.stage, self.time_start, time.perf_counter())
+
+        return False
+
+
+
+
+class NullSpan:
+    """
+    It stands in for StageSpan when timing is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+
+
+class LabelJournal:
+    """
+    It appends label changes to a json lines file, so labels survive a crash
+    without rewriting all of them.  The first line is a header naming the
+    last saved snapshot, e.g. a state file, that the changes apply to.
+    Changes are written in batches and synced to disk once per batch.  The
+    journal is compacted to the last label of each image in the background
+    once it grows past compact_size lines.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path_journal, compact_size = 10000):
+        self.path_journal = path_journal
+        self.compact_size = compact_size
+
+        self.snapshot = None
+
+        # idx -> (tag, label) of the latest change of each image...
+        self.entry_dict = OrderedDict()
+        self.num_line   = 0
+
+        # Bytes up to the end of the last complete line found by load...
+        self.size_valid = None
+
+        # Changes appended while compacting...
+        self.change_compact_list = None
+
+        self.fh     = None
+        self.lock   = threading.RLock()
+        self.thread = None
+
+
+    @staticmethod
+    def to_json(obj):
+        # Turn numpy scalars in tags into python ones...
+        if isinstance(obj, np.generic): return obj.item()
+
+        raise TypeError(f"{type(obj).__name__} is not serializable")
+
+
+    def encode(self, idx, tag, label):
+        return json.dumps({ "idx" : idx, "tag" : tag, "label" : label }, default = self.to_json) + "\n"
+
+
+    def load(self):
+        ''' Read the journal and return (snapshot, [(idx, tag, label), ...]),
+            where tags are tuples.  A partly written last line is ignored and
+            cut off once the journal is opened.
+        '''
+        self.snapshot   = None
+        self.entry_dict = OrderedDict()
+        self.num_line   = 0
+        self.size_valid = None
+        if not os.path.exists(self.path_journal): return None, []
+
+        change_list = []
+        size_valid  = 0
+        with open(self.path_journal, 'rb') as fh:
+            for i, line in enumerate(fh):
+                # Only a crash in the middle of an append leaves a line without newline...
+                if not line.endswith(b"\n"):
+                    print(f"Warning!!! Ignoring a partly written line {i} of journal {self.path_journal}.")
+                    break
+                size_valid += len(line)
+
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    print(f"Warning!!! Ignoring a broken line {i} of journal {self.path_journal}.")
+                    continue
+
+                if i == 0 and "version" in record:
+                    self.snapshot = record.get("snapshot", None)
+                    continue
+
+                idx, tag, label = int(record["idx"]), tuple(record["tag"]), record["label"]
+                change_list.append((idx, tag, label))
+
+                self.entry_dict.pop(idx, None)
+                self.entry_dict[idx] = (tag, label)
+                self.num_line += 1
+
+        self.size_valid = size_valid
+
+        return self.snapshot, change_list
+
+
+    def open(self):
+        ''' Open the journal for appending, write a header to a new journal.
+        '''
+        with self.lock:
+            if self.fh is not None: return None
+
+            drc_journal = os.path.dirname(self.path_journal)
+            if drc_journal: os.makedirs(drc_journal, exist_ok = True)
+
+            if not os.path.exists(self.path_journal): self.write(self.path_journal, self.snapshot, {})
+            else                                    : self.trim()
+            self.fh = open(self.path_journal, 'a')
+
+        return None
+
+
+    def trim(self):
+        ''' Cut a partly written last line off the journal, so that appends
+            start on a line of their own.  Without an offset from load, the
+            last line is ended instead.
+        '''
+        with open(self.path_journal, 'rb+') as fh:
+            size = fh.seek(0, os.SEEK_END)
+            if self.size_valid is not None:
+                if size > self.size_valid: fh.truncate(self.size_valid)
+            elif size > 0:
+                fh.seek(size - 1)
+                if fh.read(1) != b"\n": fh.write(b"\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+        # The offset is stale once changes are appended...
+        self.size_valid = None
+
+        return None
+
+
+    def write(self, path, snapshot, entry_dict):
+        ''' Write a complete journal to path atomically.
+        '''
+        with atomic_path(path) as path_tmp, open(path_tmp, 'w') as fh:
+            fh.write(json.dumps({ "version" : self.VERSION, "snapshot" : snapshot }) + "\n")
+            for idx, (tag, label) in entry_dict.items(): fh.write(self.encode(idx, tag, label))
+            fh.flush()
+            os.fsync(fh.fileno())
+
+        return None
+
+
+    def append(self, change_list):
+        ''' Append changes [(idx, tag, label), ...] and sync them to disk.
+        '''
+        with self.lock:
+            if self.fh is None: self.open()
+
+            self.fh.write("".join( self.encode(idx, tag, label) for idx, tag, label in change_list ))
+            self.fh.flush()
+            os.fsync(self.fh.fileno())
+
+            for idx, tag, label in change_list:
+                self.entry_dict.pop(idx, None)
+                self.entry_dict[idx] = (tag, label)
+            self.num_line += len(change_list)
+
+            if self.change_compact_list is not None: self.change_compact_list.extend(change_list)
+
+            is_due = self.num_line > max(self.compact_size, 2 * len(self.entry_dict))
+
+        if is_due: self.compact_async()
+
+        return None
+
+
+    def reset(self, snapshot = None):
+        ''' Start over from a new snapshot, which holds all changes so far.
+        '''
+        self.join()
+
+        with self.lock:
+            self.close()
+
+            self.snapshot   = snapshot
+            self.entry_dict = OrderedDict()
+            self.num_line   = 0
+            self.write(self.path_journal, snapshot, {})
+
+            self.fh = open(self.path_journal, 'a')
+
+        return None
+
+
+    def compact_async(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive(): return None
+
+            self.thread = threading.Thread(target = self.compact, daemon = True)
+            self.thread.start()
+
+        return None
+
+
+    def compact(self):
+        ''' Rewrite the journal with the latest change of each image only.
+        '''
+        with self.lock:
+            snapshot   = self.snapshot
+            entry_dict = OrderedDict(self.entry_dict)
+            self.change_compact_list = []
+
+        # Write the bulk of the journal without blocking appends...
+        path_compact = f"{self.path_journal}.compact"
+        try:
+            self.write(path_compact, snapshot, entry_dict)
+        except OSError:
+            print(f"Warning!!! Failed to compact journal {self.path_journal}.")
+            with self.lock: self.change_compact_list = None
+            return None
+
+        with self.lock:
+            # Carry over changes appended in the meantime...
+            change_list = self.change_compact_list
+            with open(path_compact, 'a') as fh:
+                fh.write("".join( self.encode(idx, tag, label) for idx, tag, label in change_list ))
+                fh.flush()
+                os.fsync(fh.fileno())
+            self.change_compact_list = None
+
+            if self.fh is not None: self.fh.close()
+            os.replace(path_compact, self.path_journal)
+            self.fh = open(self.path_journal, 'a')
+
+            self.num_line = len(entry_dict) + len(change_list)
+
+        return None
+
+
+    def join(self):
+        thread = self.thread
+        if thread is not None: thread.join()
+
+        return None
+
+
+    def close(self):
+        with self.lock:
+            if self.fh is not None:
+                self.fh.close()
+                self.fh = None
+
+        return None
+
+
+
+
+class TagTable:
+    """
+    It behaves as a read-only sequence of image tags stored as columns, one per
+    position in a tag.  Integer columns are kept as int64 arrays and string
+    columns as integer codes into a vocabulary, so millions of tags take a few
+    arrays instead of millions of Python tuples.  Tags are only built when
+    they are indexed.
+    """
+
+    CHUNK_SIZE = 65536
+
+    def __init__(self, column_list = (), num_img = 0):
+        # Each column is (values, None) or (codes, vocab)...
+        self.column_list = list(column_list)
+        self.num_img     = num_img
+
+
+    @classmethod
+    def from_tags(cls, img_tag_list):
+        ''' Split tags of the same length into columns, only strings and
+            integers are supported.
+        '''
+        if isinstance(img_tag_list, cls)       : return img_tag_list
+        if isinstance(img_tag_list, FrameIndex): return cls.from_frame_index(img_tag_list)
+
+        value_list_list = list(zip(*img_tag_list))
+
+        column_list = []
+        for i, value_list in enumerate(value_list_list):
+            kind = np.asarray(value_list[:1]).dtype.kind
+            if kind in 'iu':
+                column_list.append((np.asarray(value_list, dtype = np.int64), None))
+            elif kind == 'U':
+                # Number strings in the order they are first seen...
+                vocab_dict = {}
+                codes = np.fromiter((vocab_dict.setdefault(value, len(vocab_dict)) for value in value_list), dtype = np.int32, count = len(value_list))
+                column_list.append((codes, list(vocab_dict)))
+            else:
+                raise TypeError(f"Position {i} of image tags holds values other than strings or integers!!!")
+
+        num_img = len(value_list_list[0]) if value_list_list else len(img_tag_list)
+
+        return cls(column_list, num_img = num_img)
+
+
+    @classmethod
+    def from_frame_index(cls, frame_index):
+        ''' Expand the offset table of a FrameIndex into a key column and a
+            local index column.
+        '''
+        num_list = np.diff(np.asarray(frame_index.offset_list, dtype = np.int64))
+
+        vocab_dict = {}
+        code_list  = [ vocab_dict.setdefault(key, len(vocab_dict)) for key in frame_index.key_list ]
+
+        codes     = np.repeat(np.asarray(code_list, dtype = np.int32), num_list)
+        idx_local = np.arange(len(frame_index), dtype = np.int64) - np.repeat(np.asarray(frame_index.offset_list[:-1], dtype = np.int64), num_list)
+
+        return cls([ (codes, list(vocab_dict)), (idx_local, None) ], num_img = len(frame_index))
+
+
+    def get_tag(self, idx):
+        return tuple(int(values[idx]) if vocab is None else vocab[int(values[idx])] for values, vocab in self.column_list)
+
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice): return [ self[i] for i in range(*idx.indices(len(self))) ]
+
+        idx = operator.index(idx)
+        if idx < 0: idx += self.num_img
+        if not 0 <= idx < self.num_img: raise IndexError(f"Tag index {idx} is out of range!!!")
+
+        return self.get_tag(idx)
+
+
+    def __len__(self):
+        return self.num_img
+
+
+    def __iter__(self):
+        # Convert columns a chunk at a time...
+        for start in range(0, self.num_img, self.CHUNK_SIZE):
+            stop = min(start + self.CHUNK_SIZE, self.num_img)
+
+            chunk_list = []
+            for values, vocab in self.column_list:
+                chunk = np.asarray(values[start:stop]).tolist()
+                chunk_list.append(chunk if vocab is None else [ vocab[code] for code in chunk ])
+
+            yield from zip(*chunk_list)
+
+
+    def index(self, img_tag):
+        ''' Return the first index of img_tag.
+        '''
+        img_tag = tuple(img_tag)
+        if len(img_tag) != len(self.column_list): raise ValueError(f"{img_tag} is not in the tag table!!!")
+
+        mask = np.ones(self.num_img, dtype = bool)
+        for (values, vocab), value in zip(self.column_list, img_tag):
+            if vocab is not None:
+                if not value in vocab: raise ValueError(f"{img_tag} is not in the tag table!!!")
+                value = vocab.index(value)
+            mask &= np.asarray(values) == value
+
+        idx_list = np.flatnonzero(mask)
+        if len(idx_list) == 0: raise ValueError(f"{img_tag} is not in the tag table!!!")
+
+        return int(idx_list[0])
+
+
+    def __contains__(self, img_tag):
+        try: self.index(img_tag)
+        except (ValueError, TypeError): return False
+
+        return True
+
+
+    def __repr__(self):
+        return f"TagTable(columns = {len(self.column_list)}, tags = {len(self)})"
+
+
+
+
+class LabelColumn(MutableMapping):
+    """
+    It behaves as res_dict, a mapping from (idx, tag) to a label, but stores
+    one small integer code per image into a vocabulary of labels, with -1 for
+    unlabeled images.  Tags of keys are taken from img_tag_list.
+    """
+
+    def __init__(self, img_tag_list, codes = None, vocab = ()):
+        self.img_tag_list = img_tag_list
+
+        num_img = len(img_tag_list)
+        self.codes = np.full(num_img, -1, dtype = np.int32) if codes is None else np.array(codes, dtype = np.int32)
+        assert len(self.codes) == num_img, f"{len(self.codes)} label codes don't match {num_img} images!!!"
+
+        self.vocab      = list(vocab)
+        self.vocab_dict = { label : code for code, label in enumerate(self.vocab) }
+
+
+    def get_codes(self):
+        return self.codes, self.vocab
+
+
+    def get_idx(self, k):
+        idx, _ = k
+        idx = operator.index(idx)
+        if not 0 <= idx < len(self.codes): raise KeyError(k)
+
+        return idx
+
+
+    def __getitem__(self, k):
+        code = self.codes[self.get_idx(k)]
+        if code < 0: raise KeyError(k)
+
+        return self.vocab[code]
+
+
+    def __setitem__(self, k, label):
+        idx = self.get_idx(k)
+
+        code = self.vocab_dict.get(label, None)
+        if code is None:
+            code = len(self.vocab)
+            self.vocab.append(label)
+            self.vocab_dict[label] = code
+
+        self.codes[idx] = code
+
+
+    def __delitem__(self, k):
+        idx = self.get_idx(k)
+        if self.codes[idx] < 0: raise KeyError(k)
+
+        self.codes[idx] = -1
+
+
+    def __iter__(self):
+        for idx in np.flatnonzero(self.codes >= 0).tolist(): yield idx, self.img_tag_list[idx]
+
+
+    def __len__(self):
+        return int(np.count_nonzero(self.codes >= 0))
+
+
+    def __repr__(self):
+        return f"LabelColumn(labels = {len(self)}, vocab = {len(self.vocab)})"
+
+
+
+
+STATE_FORMAT  = "hit_labeler.state"
+STATE_VERSION = 1
+
+def is_state_file(path_state):
+    ''' Return True if path_state is a columnar state, older states are pickles.
+    '''
+    if not h5py.is_hdf5(path_state): return False
+
+    with h5py.File(path_state, 'r') as fh:
+        return fh.attrs.get('format', None) == STATE_FORMAT
+
+
+def save_state(path_state, img_tag_list, res_dict, seed = None, idx_img = 0, timestamp = ''):
+    ''' Write the tag table, label codes and the cursor of a session into one
+        uncompressed h5 file, so that columns can be memory-mapped upon load.
+    '''
+    tag_table = TagTable.from_tags(img_tag_list)
+
+    # Label codes come for free when res_dict is already columnar...
+    if isinstance(res_dict, LabelColumn) and res_dict.img_tag_list is img_tag_list:
+        codes, vocab = res_dict.get_codes()
+    else:
+        label_column = LabelColumn(tag_table)
+        num_skip = 0
+        for (idx, tag), label in res_dict.items():
+            if not 0 <= idx < len(tag_table) or tuple(tag) != tuple(img_tag_list[idx]):
+                num_skip += 1
+                continue
+            label_column[(idx, tag)] = label
+        if num_skip > 0: print(f"Warning!!! {num_skip} labels don't match the tag of their image and are not saved.")
+        codes, vocab = label_column.get_codes()
+
+    # Use the smallest integer type for label codes...
+    dtype_codes = np.int16 if len(vocab) < np.iinfo(np.int16).max else np.int32
+
+    # Write into a temporary file, only complete files are visible...
+    with atomic_path(path_state) as path_tmp:
+        with h5py.File(path_tmp, 'w') as fh:
+            fh.attrs['format']    = STATE_FORMAT
+            fh.attrs['version']   = STATE_VERSION
+            fh.attrs['num_img']   = len(tag_table)
+            fh.attrs['idx_img']   = int(idx_img)
+            fh.attrs['timestamp'] = str(timestamp)
+            # Session seeds may exceed 64 bits...
+            if seed is not None: fh.attrs['seed'] = str(int(seed))
+
+            group = fh.create_group('tags')
+            group.attrs['num_column'] = len(tag_table.column_list)
+            for i, (values, vocab_tag) in enumerate(tag_table.column_list):
+                group_column = group.create_group(str(i))
+                if vocab_tag is None:
+                    group_column.create_dataset('values', data = np.asarray(values, dtype = np.int64))
+                else:
+                    group_column.create_dataset('codes', data = np.asarray(values, dtype = np.int32))
+                    group_column.create_dataset('vocab', data = np.array(vocab_tag, dtype = h5py.string_dtype()))
+
+            group = fh.create_group('labels')
+            group.create_dataset('codes', data = np.asarray(codes, dtype = dtype_codes))
+            group.create_dataset('vocab', data = np.array(vocab, dtype = h5py.string_dtype()))
+
+    return None
+
+
+def load_state(path_state):
+    ''' Return (img_tag_list, seed, res_dict, idx_img, timestamp) saved by
+        save_state.  Tag columns are memory-mapped rather than read.
+    '''
+    with h5py.File(path_state, 'r') as fh:
+        assert fh.attrs.get('format', None) == STATE_FORMAT, f"{path_state} is not a session state!!!"
+
+        version = int(fh.attrs['version'])
+        assert version <= STATE_VERSION, f"State version {version} of {path_state} is newer than {STATE_VERSION}!!!"
+
+        num_img   = int(fh.attrs['num_img'])
+        idx_img   = int(fh.attrs['idx_img'])
+        timestamp = str(fh.attrs['timestamp'])
+        seed      = int(str(fh.attrs['seed'])) if 'seed' in fh.attrs else None
+
+        column_list = []
+        group = fh['tags']
+        for i in range(int(group.attrs['num_column'])):
+            group_column = group[str(i)]
+            if 'values' in group_column:
+                dataset = group_column['values']
+                vocab   = None
+            else:
+                dataset = group_column['codes']
+                vocab   = group_column['vocab'].asstr()[()].tolist()
+
+            # Fall back to reading when the column can't be memory-mapped...
+            values = memmap_h5_dataset(path_state, dataset)
+            if values is None: values = dataset[()]
+
+            column_list.append((values, vocab))
+
+        group = fh['labels']
+        codes = group['codes'][()]
+        vocab = group['vocab'].asstr()[()].tolist()
+
+    img_tag_list = TagTable(column_list, num_img = num_img)
+    res_dict     = LabelColumn(img_tag_list, codes = codes, vocab = vocab)
+
+    return img_tag_list, seed, res_dict, idx_img, timestamp
@@ -3,13 +3,22 @@
 
 import os
 import sys
+import math
 import pickle
 import csv
+import time
+from functools import partial
 
 from pyqtgraph    import LabelItem
 from pyqtgraph.Qt import QtGui, QtWidgets, QtCore
 
+from hit_labeler.utils import SortedFilter, pack_tiles, save_state, load_state, is_state_file
+
 class Window(QtGui.QMainWindow):
+    # Hand decoded images from worker threads over to the GUI thread...
+    frameLoaded = QtCore.Signal(int, int, object)
+    pageLoaded  = QtCore.Signal(int, int, object, object)
+
     def __init__(self, layout, data_manager):
         super().__init__()
 
@@ -27,31 +36,78 @@ class Window(QtGui.QMainWindow):
         self.num_img = len(self.data_manager.img_tag_list)
 
         self.idx_img = 0
-        self.is_filter_enabled = False
-        self.idx_filtered_list = {}
-        self.idx_filtered_dict = {}
+        self.direction = 1
+        self.idx_filter = None
+
+        # Only the image of the latest request is drawn...
+        self.id_request = 0
+        self.frameLoaded.connect(self.drawImg)
+
+        # Page of thumbnails in the grid view...
+        self.idx_page           = 0
+        self.id_page_request    = 0
+        self.tile_idx_list      = []
+        self.tile_shape         = None
+        self.tile_stride        = None
+        self.tile_selected_dict = {}
+        self.pageLoaded.connect(self.drawPage)
+        self.layout.viewer_grid.scene.sigMouseClicked.connect(self.clickTile)
 
         self.setupButtonFunction()
         self.setupButtonShortcut()
+        self.setupLabelShortcut()
+
+        # Report buffered label changes every few seconds...
+        self.timer_label = QtCore.QTimer(self)
+        self.timer_label.timeout.connect(self.data_manager.flush_labels)
+        self.timer_label.start(5000)
+
+        # Overlay latency percentiles of each stage on demand...
+        self.label_timing = QtWidgets.QLabel(self.layout.viewer_img)
+        self.label_timing.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: white; font-family: monospace; padding: 4px;")
+        self.label_timing.move(10, 30)
+        self.label_timing.hide()
+        self.timer_timing = QtCore.QTimer(self)
+        self.timer_timing.timeout.connect(self.updateTiming)
+
+        # Bring back labels of a session that ended without saving...
+        self.recoverLabels()
 
         self.dispImg()
+        self.dispPage()
+
+        # Compute per-frame statistics in the background...
+        if self.data_manager.stats_build: self.data_manager.build_stats()
 
         return None
 
 
     def config(self):
         self.setCentralWidget(self.layout.area)
-        self.resize(700, 700)
+        self.resize(1400, 700)
         self.setWindowTitle(f"Hit labeler | Player: {self.username}")
 
         return None
 
 
+    def closeEvent(self, event):
+        # Release open file handles held by the data manager...
+        self.data_manager.close()
+
+        super().closeEvent(event)
+
+        return None
+
+
     def setupButtonFunction(self):
         self.layout.btn_next_img.clicked.connect(self.nextImg)
         self.layout.btn_prev_img.clicked.connect(self.prevImg)
         self.layout.btn_label.clicked.connect(self.labelImg)
 
+        self.layout.btn_next_page.clicked.connect(self.nextPage)
+        self.layout.btn_prev_page.clicked.connect(self.prevPage)
+        self.layout.btn_label_tile.clicked.connect(self.labelTiles)
+
         return None
 
 
@@ -67,6 +123,22 @@ class Window(QtGui.QMainWindow):
         return None
 
 
+    def setupLabelShortcut(self):
+        ''' Apply a label with one key press according to label_keys, e.g.
+            { "1" : "hit", "2" : "miss" }.
+        '''
+        key_reserved_list = [ QtGui.QKeySequence(key) for key in ("N", "P", "L", "G") ]
+        for key, label_str in self.data_manager.label_keys.items():
+            key_seq = QtGui.QKeySequence(key)
+            if key_seq in key_reserved_list:
+                print(f"Warning!!! Key '{key}' is already taken, label '{label_str}' has no shortcut.")
+                continue
+
+            QtGui.QShortcut(key_seq, self, partial(self.labelImgByKey, label_str))
+
+        return None
+
+
     ###############
     ### DIPSLAY ###
     ###############
@@ -74,15 +146,187 @@ class Window(QtGui.QMainWindow):
         # Let idx_img bound within reasonable range....
         self.idx_img = min(max(0, self.idx_img), self.num_img - 1)
 
-        img = self.data_manager.get_img(self.idx_img)
+        # Tag the request, images of older ones are dropped...
+        self.id_request += 1
+        id_request = self.id_request
+        idx_img    = self.idx_img
+
+        # Decode the image off the GUI thread, so key presses are never queued behind reads...
+        self.time_request = time.perf_counter()
+        future = self.data_manager.request_pyramid(idx_img)
+        if not future.done(): self.statusBar().showMessage(f"Loading {idx_img}...")
+        future.add_done_callback(lambda future: self.frameLoaded.emit(id_request, idx_img, future))
+
+        # Decode upcoming images while the current one is on screen...
+        self.data_manager.prefetch(idx_img, self.direction, self.idx_filter)
+
+        return None
 
-        # Display images...
-        self.layout.viewer_img.setImage(img, levels = [0, 1])
-        self.layout.viewer_img.setHistogramRange(0, 1)
+
+    def drawImg(self, id_request, idx_img, future):
+        # Drop the image if the user has moved on...
+        if id_request != self.id_request or future.cancelled(): return None
+
+        try:
+            img_pyramid = future.result()
+        except Exception as e:
+            self.statusBar().showMessage(f"Failed to load {idx_img}: {e}")
+            return None
+
+        # Set levels from stored statistics instead of scanning the image...
+        levels = self.data_manager.get_levels(idx_img)
+
+        # Display the coarsest level first, it is cheap to render...
+        bin_size, img = img_pyramid[0]
+        self.setImg(img, bin_size, levels)
+        self.layout.viewer_img.setHistogramRange(*levels)
         self.layout.viewer_img.getView().autoRange()
 
+        # Record how long the user waited from the request to the first draw...
+        self.data_manager.timer.record("latency", self.time_request, time.perf_counter())
+
         # Display title...
-        self.layout.viewer_img.getView().setTitle(f"Sequence number: {self.idx_img}/{self.num_img - 1}")
+        self.setTitle(idx_img)
+        self.statusBar().clearMessage()
+
+        # Swap in finer levels once pending key presses are handled...
+        if len(img_pyramid) > 1:
+            QtCore.QTimer.singleShot(0, lambda: self.refineImg(id_request, img_pyramid[1:], levels))
+
+        return None
+
+
+    def setTitle(self, idx_img):
+        title = f"Sequence number: {idx_img}/{self.num_img - 1}"
+
+        # Show the label of the image once it has one...
+        label_str = self.data_manager.label_index.get(idx_img)
+        if label_str is not None: title += f" | Label: {label_str}"
+
+        self.layout.viewer_img.getView().setTitle(title)
+
+        return None
+
+
+    def setImg(self, img, bin_size = 1, levels = (0, 1)):
+        ''' Display img binned by bin_size in the pixel coordinates of the full
+            resolution image, so the view doesn't move between levels.
+        '''
+        with self.data_manager.timer.time("setImage"):
+            self.layout.viewer_img.setImage(img, levels      = levels,
+                                                 autoRange   = False,
+                                                 transform   = QtGui.QTransform.fromScale(bin_size, bin_size))
+
+        return None
+
+
+    def refineImg(self, id_request, img_pyramid, levels):
+        # Drop the swap if the user has moved on...
+        if id_request != self.id_request: return None
+
+        bin_size, img = img_pyramid[0]
+        self.setImg(img, bin_size, levels)
+
+        if len(img_pyramid) > 1:
+            QtCore.QTimer.singleShot(0, lambda: self.refineImg(id_request, img_pyramid[1:], levels))
+
+        return None
+
+
+    def dispPage(self):
+        num_page = self.get_num_page()
+        self.idx_page = min(max(0, self.idx_page), num_page - 1)
+
+        # Tag the request, pages of older ones are dropped...
+        self.id_page_request += 1
+        id_request = self.id_page_request
+        idx_page   = self.idx_page
+
+        # Make thumbnails of the page off the GUI thread in one batch...
+        idx_list = self.data_manager.get_page(idx_page)
+        future   = self.data_manager.submit(self.data_manager.get_thumbnails, idx_list)
+        if not future.done(): self.statusBar().showMessage(f"Loading page {idx_page}...")
+        future.add_done_callback(lambda future: self.pageLoaded.emit(id_request, idx_page, idx_list, future))
+
+        return None
+
+
+    def drawPage(self, id_request, idx_page, idx_list, future):
+        # Drop the page if the user has moved on...
+        if id_request != self.id_page_request or future.cancelled(): return None
+
+        try:
+            thumbnail_list = future.result()
+        except Exception as e:
+            self.statusBar().showMessage(f"Failed to load page {idx_page}: {e}")
+            return None
+
+        # ImageView shows axis 0 along x and y downwards, so tile k goes to column k % num_col and row k // num_col...
+        num_col  = self.data_manager.grid_shape[1]
+        pos_list = [ (k % num_col, k // num_col) for k in range(len(thumbnail_list)) ]
+
+        # Render the page as one image...
+        levels = self.data_manager.get_tile_levels(thumbnail_list)
+        atlas, stride = pack_tiles(thumbnail_list, pos_list, fill_value = levels[0])
+
+        self.clearTileSelection()
+        self.layout.viewer_grid.setImage(atlas, levels = levels)
+        self.layout.viewer_grid.setHistogramRange(*levels)
+        self.layout.viewer_grid.getView().setTitle(f"Page {idx_page}/{self.get_num_page() - 1}: {idx_list[0]}-{idx_list[-1]}")
+        self.statusBar().clearMessage()
+
+        self.tile_idx_list = idx_list
+        self.tile_shape    = thumbnail_list[0].shape
+        self.tile_stride   = stride
+
+        # Make thumbnails of the next page while this one is reviewed...
+        if idx_page + 1 < self.get_num_page(): self.data_manager.prefetch_page(idx_page + 1)
+
+        return None
+
+
+    def get_num_page(self):
+        num_tile = self.data_manager.grid_shape[0] * self.data_manager.grid_shape[1]
+
+        return max(1, math.ceil(self.num_img / num_tile))
+
+
+    def clickTile(self, event):
+        if not self.tile_idx_list: return None
+
+        # Locate the tile under the cursor...
+        pos = self.layout.viewer_grid.getImageItem().mapFromScene(event.scenePos())
+        if pos.x() < 0 or pos.y() < 0: return None
+        i = int(pos.x() // self.tile_stride[0])
+        j = int(pos.y() // self.tile_stride[1])
+
+        num_col = self.data_manager.grid_shape[1]
+        k = j * num_col + i
+        if i >= num_col or k >= len(self.tile_idx_list): return None
+
+        # Open the image in the main view upon a double click...
+        if event.double():
+            self.idx_img = self.tile_idx_list[k]
+            self.dispImg()
+
+            return None
+
+        # Otherwise toggle the selection of the tile...
+        if k in self.tile_selected_dict:
+            rect = self.tile_selected_dict.pop(k)
+            rect.scene().removeItem(rect)
+        else:
+            rect = QtWidgets.QGraphicsRectItem(i * self.tile_stride[0], j * self.tile_stride[1], *self.tile_shape)
+            rect.setPen(QtGui.QPen(QtGui.QColor("yellow"), 0))
+            rect.setParentItem(self.layout.viewer_grid.getImageItem())
+            self.tile_selected_dict[k] = rect
+
+        return None
+
+
+    def clearTileSelection(self):
+        for rect in self.tile_selected_dict.values(): rect.scene().removeItem(rect)
+        self.tile_selected_dict = {}
 
         return None
 
@@ -90,17 +334,33 @@ class Window(QtGui.QMainWindow):
     ##################
     ### NAVIGATION ###
     ##################
+    def nextPage(self):
+        # Support rollover...
+        idx_next = self.idx_page + 1
+        self.idx_page = idx_next if idx_next < self.get_num_page() else 0
+
+        self.dispPage()
+
+        return None
+
+
+    def prevPage(self):
+        # Support rollover...
+        idx_prev = self.idx_page - 1
+        self.idx_page = idx_prev if -1 < idx_prev else self.get_num_page() - 1
+
+        self.dispPage()
+
+        return None
+
+
     def nextImg(self):
-        if self.is_filter_enabled:
-            # If the current image has the filtered label???
-            if self.idx_img in self.idx_filtered_dict:
-                self.idx_img = self.idx_filtered_dict[self.idx_img]["next"]
+        self.direction = 1
 
-            # Otherwise, find the nearest next event or revert to the initial event...
-            else:
-                try: idx_nearest_next = next(filter(lambda x: x > self.idx_img, self.idx_filtered_list))
-                except StopIteration: idx_nearest_next = self.idx_filtered_list[0]
-                self.idx_img = idx_nearest_next
+        if self.idx_filter is not None:
+            # Find the nearest next event or revert to the initial event...
+            idx_next = self.idx_filter.find_next(self.idx_img)
+            if idx_next is not None: self.idx_img = idx_next
         else:
             # Support rollover...
             idx_next = self.idx_img + 1
@@ -113,17 +373,12 @@ class Window(QtGui.QMainWindow):
 
     def prevImg(self):
         idx_img_current = self.idx_img
+        self.direction  = -1
 
-        if self.is_filter_enabled:
-            # If the current image has the filtered label???
-            if self.idx_img in self.idx_filtered_dict:
-                self.idx_img = self.idx_filtered_dict[self.idx_img]["prev"]
-
-            # Otherwise, find the nearest prev event or revert to the initial event...
-            else:
-                try: idx_nearest_prev = next(filter(lambda x: x > self.idx_img, reversed(self.idx_filtered_list)))
-                except StopIteration: idx_nearest_prev = self.idx_filtered_list[-1]
-                self.idx_img = idx_nearest_prev
+        if self.idx_filter is not None:
+            # Find the nearest prev event or revert to the last event...
+            idx_prev = self.idx_filter.find_prev(self.idx_img)
+            if idx_prev is not None: self.idx_img = idx_prev
         else:
             # Support rollover...
             idx_prev = self.idx_img - 1
@@ -136,52 +391,71 @@ class Window(QtGui.QMainWindow):
         return None
 
 
-    def labelCXIImg(self, label_str):
-        img_tag = self.data_manager.img_tag_list[self.idx_img]
-
-        k = (self.idx_img, img_tag)
-        self.data_manager.res_dict[k] = label_str
+    def applyLabel(self, label_str):
+        self.data_manager.set_label(self.idx_img, label_str)
 
-        print(f"{self.idx_img}, {img_tag} has a label: {label_str}.")
+        self.setTitle(self.idx_img)
 
         return None
 
 
-    def labelPsanaImg(self, label_str):
-        img_tag = self.data_manager.img_tag_list[self.idx_img]
+    def labelImgByKey(self, label_str):
+        self.applyLabel(label_str)
 
-        k = (self.idx_img, img_tag)
-        self.data_manager.res_dict[k] = label_str
-
-        print(f"{self.idx_img}, {img_tag} has a label: {label_str}.")
+        # Move on to the next image right away...
+        if self.data_manager.label_advance: self.nextImg()
 
         return None
 
 
-    def labelSkopiH5(self, label_str):
-        img_tag = self.data_manager.img_tag_list[self.idx_img]
-
-        k = (self.idx_img, img_tag)
-        self.data_manager.res_dict[k] = label_str
+    def labelImg(self):
+        # Fetch label from the GUI user prompt
+        label_str, is_ok = QtGui.QInputDialog.getText(self, "Enter new label", "Enter new label")
 
-        print(f"{self.idx_img}, {img_tag} has a label: {label_str}.")
+        # Process the OK event
+        if is_ok and len(label_str) > 0:
+            self.applyLabel(label_str)
 
         return None
 
 
-    def labelImg(self):
+    def labelTiles(self):
+        if not self.tile_selected_dict:
+            self.statusBar().showMessage("No tile is selected, click on tiles to select them.")
+            return None
+
         # Fetch label from the GUI user prompt
         label_str, is_ok = QtGui.QInputDialog.getText(self, "Enter new label", "Enter new label")
 
         # Process the OK event
         if is_ok and len(label_str) > 0:
-            label_img_option = self.MANAGER
-            label_img_dict = { 
-                'cxi'     : self.labelCXIImg,
-                'psana'   : self.labelPsanaImg,
-                'skopih5' : self.labelSkopiH5,
-            }
-            label_img_dict[label_img_option](label_str)
+            idx_list = [ self.tile_idx_list[k] for k in sorted(self.tile_selected_dict) ]
+            for idx in idx_list: self.data_manager.set_label(idx, label_str)
+
+            self.statusBar().showMessage(f"{len(idx_list)} images on page {self.idx_page} have a label: {label_str}.", 3000)
+
+            self.clearTileSelection()
+            self.setTitle(self.idx_img)
+
+        return None
+
+
+    def toggleTiming(self, is_checked):
+        if is_checked:
+            self.updateTiming()
+            self.label_timing.show()
+            self.timer_timing.start(1000)
+        else:
+            self.timer_timing.stop()
+            self.label_timing.hide()
+
+        return None
+
+
+    def updateTiming(self):
+        summary = self.data_manager.timer.summarize()
+        self.label_timing.setText(summary if summary else "No timing yet")
+        self.label_timing.adjustSize()
 
         return None
 
@@ -190,37 +464,90 @@ class Window(QtGui.QMainWindow):
     ### MENU BAR ###
     ################
     def saveStateDialog(self):
-        path_pickle, is_ok = QtGui.QFileDialog.getSaveFileName(self, 'Save File', f'{self.timestamp}.pickle')
+        path_state, is_ok = QtGui.QFileDialog.getSaveFileName(self, 'Save File', f'{self.timestamp}.state.h5')
 
         if is_ok:
-            obj_to_save = ( self.data_manager.img_tag_list,
-                            self.data_manager.state_random,
-                            self.data_manager.res_dict,
-                            self.idx_img,
-                            self.timestamp )
+            save_state(path_state, self.data_manager.img_tag_list,
+                                   self.data_manager.res_dict,
+                                   seed      = self.data_manager.get_seed(),
+                                   idx_img   = self.idx_img,
+                                   timestamp = self.timestamp)
+
+            # Keep frame statistics next to the state...
+            self.data_manager.save_stats(f"{path_state}.stats.npz")
 
-            with open(path_pickle, 'wb') as fh:
-                pickle.dump(obj_to_save, fh, protocol = pickle.HIGHEST_PROTOCOL)
+            # The journal only needs changes made after this state...
+            self.data_manager.reset_journal(os.path.abspath(path_state))
 
             print(f"State saved")
 
         return None
 
 
+    def readState(self, path_state):
+        if is_state_file(path_state):
+            obj_saved = load_state(path_state)
+        else:
+            # States saved before the columnar format are pickles...
+            with open(path_state, 'rb') as fh:
+                obj_saved = pickle.load(fh)
+
+        self.data_manager.img_tag_list  = obj_saved[0]
+        seed                            = obj_saved[1]
+        self.data_manager.res_dict      = obj_saved[2]
+        self.data_manager.reset_label_index()
+        self.idx_img                    = obj_saved[3]
+        self.timestamp                  = obj_saved[4]
+
+        self.num_img = len(self.data_manager.img_tag_list)
+
+        # Reproduce augmentation of the saved session, older states keep a snapshot of the global RNG instead...
+        if isinstance(seed, int): self.data_manager.seed = seed
+
+        # Cached images may belong to another tag list or seed...
+        self.data_manager.stop_stats()
+        self.data_manager.invalidate_cache()
+
+        # Resume frame statistics from those saved with the state...
+        self.data_manager.load_stats(f"{path_state}.stats.npz")
+
+        return None
+
+
     def loadStateDialog(self):
-        path_pickle = QtGui.QFileDialog.getOpenFileName(self, 'Open File')[0]
+        path_state = QtGui.QFileDialog.getOpenFileName(self, 'Open File')[0]
 
-        if os.path.exists(path_pickle):
-            with open(path_pickle, 'rb') as fh:
-                obj_saved = pickle.load(fh)
-                self.data_manager.img_tag_list  = obj_saved[0]
-                self.data_manager.state_random  = obj_saved[1]
-                self.data_manager.res_dict      = obj_saved[2]
-                self.idx_img                    = obj_saved[3]
-                self.timestamp                  = obj_saved[4]
+        if os.path.exists(path_state):
+            self.readState(path_state)
+
+            # Later changes apply to the loaded state...
+            self.data_manager.reset_journal(os.path.abspath(path_state))
+
+            if self.data_manager.stats_build: self.data_manager.build_stats()
 
             self.disableFilter()
             self.dispImg()
+            self.dispPage()
+
+        return None
+
+
+    def recoverLabels(self):
+        ''' Load the snapshot named by the journal, if any, then replay label
+            changes journaled after it.
+        '''
+        snapshot, change_list = self.data_manager.open_journal()
+
+        if snapshot is not None:
+            if os.path.exists(snapshot):
+                self.readState(snapshot)
+                print(f"State {snapshot} is loaded as the base of the journal.")
+            else:
+                print(f"Warning!!! State {snapshot} of the journal is missing, replaying labels over the source.")
+
+        if change_list:
+            num_replay = self.data_manager.replay_labels(change_list)
+            print(f"Recovered {num_replay} label changes from {self.data_manager.journal.path_journal}.")
 
         return None
 
@@ -240,19 +567,18 @@ class Window(QtGui.QMainWindow):
 
                 img_label_dict[img_tag] = label
 
-        # An intermediate step to locate key in res_dict...
+        # An intermediate step to locate the index of each tag...
         img_tag_dict = {}
         for i, img_tag in enumerate(self.data_manager.img_tag_list):
-            img_tag_dict[img_tag] = (i, img_tag)
+            img_tag_dict[img_tag] = i
 
         # Update labels for existing tags...
         for img_tag, label in img_label_dict.items():
-            # Form the key to look up label in res_dict...
-            k = img_tag_dict.get(img_tag, None)
+            i = img_tag_dict.get(img_tag, None)
 
             # Assign new label...
-            if k is not None:
-                self.data_manager.res_dict[k] = label
+            if i is not None:
+                self.data_manager.set_label(i, label)
 
         return None
 
@@ -337,6 +663,17 @@ class Window(QtGui.QMainWindow):
         return None
 
 
+    def exportTimingDialog(self):
+        path_timing, is_ok = QtGui.QFileDialog.getSaveFileName(self, 'Export timing', f'{self.timestamp}.timing.json', "Chrome trace (*.json);;CSV (*.csv)")
+
+        if is_ok and path_timing:
+            if path_timing.endswith(".csv"): self.data_manager.timer.export_csv(path_timing)
+            else                           : self.data_manager.timer.export_trace(path_timing)
+            print(f"{path_timing} has been updated.")
+
+        return None
+
+
     def goEventDialog(self):
         idx, is_ok = QtGui.QInputDialog.getText(self, "Enter the event number to go", "Enter the event number to go")
 
@@ -352,45 +689,72 @@ class Window(QtGui.QMainWindow):
 
 
     def enableFilter(self):
-        label_str, is_ok = QtGui.QInputDialog.getText(self, "Enable filtering model", "What's the label to filter")
+        query_str, is_ok = QtGui.QInputDialog.getText(self, "Enable filtering model", "What's the label to filter, e.g. hit, hit|multi or !hit")
 
-        idx_filtered_list = []
-        idx_filtered_dict = {}
         if is_ok:
-            # Find all indices associated to one label...
-            idx_filtered_list = sorted([ int(k_idx) for (k_idx, k_fl), v in self.data_manager.res_dict.items() if v == label_str ])
+            # Parse the query "[!]label[|label...]", where ! takes the complement...
+            invert     = query_str.startswith("!")
+            label_list = query_str[1:].split("|") if invert else query_str.split("|")
+
+            idx_filter = self.data_manager.label_index.query(label_list, invert = invert)
 
-            # Build up a lookup table for quickly accessing the filtered next/prev event number
-            for i, v in enumerate(idx_filtered_list):
-                idx_filtered_dict[v] = { "prev" : idx_filtered_list[max(0, i - 1)],
-                                         "next" : idx_filtered_list[min(len(idx_filtered_list) - 1, i + 1)] }
+            if not idx_filter.is_empty():
+                self.setFilter(idx_filter)
+            else:
+                print("Warning!!! There is no images with label '{label_str}'.".format( label_str = query_str ))
+
+        return None
+
+
+    def enableStatsFilter(self):
+        if self.data_manager.frame_stats is None:
+            print("Warning!!! There are no frame statistics, turn on stats_build or load a state saved with them.")
+            return None
+
+        query_str, is_ok = QtGui.QInputDialog.getText(self, "Enable filtering model", "Statistic and range to filter, e.g. photons 1000 inf")
+
+        if is_ok:
+            frame_stats = self.data_manager.frame_stats
+
+            # Parse the query "key [lo [hi]]"...
+            query_list = query_str.split()
+            if not query_list or query_list[0] not in frame_stats.get_keys():
+                print(f"Warning!!! Unknown statistic in '{query_str}', choose from {frame_stats.get_keys()}.")
+                return None
+            try:
+                bound_list = [ float(v) for v in query_list[1:3] ]
+            except ValueError:
+                print(f"Warning!!! Invalid range in '{query_str}'.")
+                return None
+            key = query_list[0]
+            lo  = bound_list[0] if len(bound_list) > 0 else -float('inf')
+            hi  = bound_list[1] if len(bound_list) > 1 else  float('inf')
+
+            # Only frames whose statistics are computed can match...
+            idx_filtered_list = frame_stats.select(key, lo, hi).tolist()
 
             if idx_filtered_list:
-                # Confirm availability of filtered events...
-                self.is_filter_enabled = True
-
-                # Allow rollover on both ends...
-                end_left = idx_filtered_list[0]
-                end_rght = idx_filtered_list[-1]
-                idx_filtered_dict[end_left]["prev"] = end_rght
-                idx_filtered_dict[end_rght]["next"] = end_left
-
-                # Save the filtered record...
-                self.idx_filtered_list = idx_filtered_list
-                self.idx_filtered_dict = idx_filtered_dict
-
-                # Start to display it...
-                self.idx_img = idx_filtered_list[0]
-                self.dispImg()
+                self.setFilter(SortedFilter(idx_filtered_list))
             else:
-                print("Warning!!! There is no images with label '{label_str}'.".format( label_str = label_str ))
+                num_missing = len(frame_stats.get_missing())
+                print(f"Warning!!! There is no images with {key} in [{lo}, {hi}], statistics of {num_missing} images are not computed yet.")
+
+        return None
+
+
+    def setFilter(self, idx_filter):
+        # Step through the filtered events only...
+        self.idx_filter = idx_filter
+
+        # Start to display it...
+        self.idx_img = idx_filter.find_first()
+        self.dispImg()
 
         return None
 
 
     def disableFilter(self):
-        self.is_filter_enabled = False
-        self.idx_filtered_dict = {}
+        self.idx_filter = None
 
         return None
 
@@ -418,8 +782,16 @@ class Window(QtGui.QMainWindow):
         menuBar.addMenu(filterMenu)
 
         filterMenu.addAction(self.filterEnableAction)
+        filterMenu.addAction(self.filterStatsAction)
         filterMenu.addAction(self.filterDisableAction)
 
+        # Timing menu
+        timingMenu = QtWidgets.QMenu("&Timing", self)
+        menuBar.addMenu(timingMenu)
+
+        timingMenu.addAction(self.timingShowAction)
+        timingMenu.addAction(self.timingExportAction)
+
         return None
 
 
@@ -442,9 +814,19 @@ class Window(QtGui.QMainWindow):
         self.filterEnableAction = QtWidgets.QAction(self)
         self.filterEnableAction.setText("&Enable")
 
+        self.filterStatsAction = QtWidgets.QAction(self)
+        self.filterStatsAction.setText("&Statistics")
+
         self.filterDisableAction = QtWidgets.QAction(self)
         self.filterDisableAction.setText("&Disable")
 
+        self.timingShowAction = QtWidgets.QAction(self)
+        self.timingShowAction.setText("&Show")
+        self.timingShowAction.setCheckable(True)
+
+        self.timingExportAction = QtWidgets.QAction(self)
+        self.timingExportAction.setText("&Export")
+
         return None
 
 
@@ -457,6 +839,10 @@ class Window(QtGui.QMainWindow):
         self.goAction.triggered.connect(self.goEventDialog)
 
         self.filterEnableAction.triggered.connect(self.enableFilter)
+        self.filterStatsAction.triggered.connect(self.enableStatsFilter)
         self.filterDisableAction.triggered.connect(self.disableFilter)
 
+        self.timingShowAction.toggled.connect(self.toggleTiming)
+        self.timingExportAction.triggered.connect(self.exportTimingDialog)
+
         return None
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import itertools
+import threading
+import queue
+import multiprocessing
+import numpy as np
+from concurrent.futures import Future
+
+from hit_labeler.utils import PsanaReaderCache
+
+# Shared memory is only available from Python 3.8 on...
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+def run_worker(task_queue, result_queue, slot_name_list, slot_nbytes, mode, detector_name, max_readers, reader_class, reader_kwargs):
+    ''' Serve read requests in a worker process, which owns its own readers.
+    '''
+    reader_cache = PsanaReaderCache(mode, detector_name, max_open      = max_readers,
+                                                         reader_class  = reader_class,
+                                                         reader_kwargs = reader_kwargs)
+
+    # Attach shared memory slots once...
+    slot_list = [ shared_memory.SharedMemory(name = name) for name in slot_name_list ]
+
+    while True:
+        task = task_queue.get()
+        if task is None: break
+
+        task_id, idx_slot, exp, run, event_num, mode_read = task
+        try:
+            img = np.ascontiguousarray(reader_cache.read(exp, run, event_num, mode = mode_read))
+
+            # Hand over the frame through the slot, or pickle it when it doesn't fit...
+            if idx_slot is not None and img.nbytes <= slot_nbytes:
+                np.ndarray(img.shape, dtype = img.dtype, buffer = slot_list[idx_slot].buf)[...] = img
+                result_queue.put((task_id, (img.shape, img.dtype.str), None))
+            else:
+                result_queue.put((task_id, img, None))
+        except Exception as e:
+            result_queue.put((task_id, None, f"{type(e).__name__}: {e}"))
+
+    for slot in slot_list: slot.close()
+    reader_cache.close_all()
+
+    return None
+
+
+
+
+class PsanaWorkerPool:
+    """
+    It reads psana events in worker processes, since psana holds the GIL for
+    most of its work.  Each worker owns its own readers.  Events of one (exp,
+    run) preferably go to the worker that opened it, but spill over to less
+    busy workers, which open their own reader of the run.  Frames come back
+    through preallocated shared memory slots rather than being pickled.
+
+    Tasks of a worker that dies, or still in flight when the pool is closed,
+    fail with a RuntimeError instead of waiting forever.
+
+    reader_class must be importable by the workers, e.g. PsanaImg or a
+    stand-in defined at module level.  With the spawn start method, scripts
+    creating the pool need an if __name__ == "__main__" guard.
+    """
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, mode, detector_name, num_procs     = 4,
+                                            max_readers   = 4,
+                                            reader_class  = None,
+                                            reader_kwargs = None,
+                                            slot_nbytes   = 16 * 1024 ** 2,
+                                            num_slots     = None,
+                                            mp_context    = 'spawn'):
+        self.num_procs   = max(1, int(num_procs))
+        self.slot_nbytes = slot_nbytes
+
+        ctx = multiprocessing.get_context(mp_context)
+
+        # Preallocate shared memory slots, each holds one frame in flight...
+        self.slot_list  = []
+        self.slot_queue = queue.Queue()
+        if shared_memory is not None:
+            num_slots = 2 * self.num_procs if num_slots is None else num_slots
+            for idx_slot in range(num_slots):
+                self.slot_list.append(shared_memory.SharedMemory(create = True, size = slot_nbytes))
+                self.slot_queue.put(idx_slot)
+        slot_name_list = [ slot.name for slot in self.slot_list ]
+
+        # Start workers, each with its own task queue to keep runs on one worker...
+        self.result_queue    = ctx.Queue()
+        self.task_queue_list = []
+        self.proc_list       = []
+        for _ in range(self.num_procs):
+            task_queue = ctx.Queue()
+            proc = ctx.Process(target = run_worker,
+                               args   = (task_queue, self.result_queue, slot_name_list, slot_nbytes,
+                                         mode, detector_name, max_readers, reader_class, reader_kwargs),
+                               daemon = True)
+            proc.start()
+            self.task_queue_list.append(task_queue)
+            self.proc_list.append(proc)
+
+        # Assign runs to workers in the order they are first seen...
+        self.worker_dict = {}
+
+        # Futures of tasks in flight and their number per worker...
+        self.task_counter   = itertools.count()
+        self.task_dict      = {}
+        self.num_task_list  = [0] * self.num_procs
+        self.is_dead_list   = [False] * self.num_procs
+        self.is_closing     = False
+        self.lock           = threading.Lock()
+
+        # Collect results in the background...
+        self.collector = threading.Thread(target = self.collect, daemon = True)
+        self.collector.start()
+
+        return None
+
+
+    def get_worker(self, exp, run):
+        ''' Return the preferred worker of a run unless it is busier than the
+            least busy worker.  Called with the lock held.
+        '''
+        idx_alive_list = [ idx_worker for idx_worker, is_dead in enumerate(self.is_dead_list) if not is_dead ]
+        if not idx_alive_list: raise RuntimeError("All psana workers have died!!!")
+
+        basename = (exp, run)
+        if not basename in self.worker_dict or self.is_dead_list[self.worker_dict[basename]]:
+            self.worker_dict[basename] = idx_alive_list[len(self.worker_dict) % len(idx_alive_list)]
+        idx_worker = self.worker_dict[basename]
+
+        # Let an idle worker take the event, it opens the run on its own...
+        idx_least = min(idx_alive_list, key = self.num_task_list.__getitem__)
+        if self.num_task_list[idx_least] < self.num_task_list[idx_worker]: idx_worker = idx_least
+
+        return idx_worker
+
+
+    def submit(self, exp, run, event_num, mode = "image"):
+        if self.is_closing: raise RuntimeError("Psana worker pool is closed!!!")
+
+        # Wait for a free slot when all of them are in flight...
+        idx_slot = self.slot_queue.get() if self.slot_list else None
+
+        future = Future()
+        with self.lock:
+            try:
+                if self.is_closing: raise RuntimeError("Psana worker pool is closed!!!")
+                idx_worker = self.get_worker(exp, run)
+            except RuntimeError:
+                if idx_slot is not None: self.slot_queue.put(idx_slot)
+                raise
+
+            task_id = next(self.task_counter)
+            self.task_dict[task_id] = (future, idx_slot, idx_worker)
+            self.num_task_list[idx_worker] += 1
+
+            task = (task_id, idx_slot, exp, run, int(event_num), mode)
+            self.task_queue_list[idx_worker].put(task)
+
+        return future
+
+
+    def read(self, exp, run, event_num, mode = "image"):
+        return self.submit(exp, run, event_num, mode = mode).result()
+
+
+    def collect(self):
+        while True:
+            # Look for dead workers while waiting...
+            try:
+                result = self.result_queue.get(timeout = self.POLL_INTERVAL)
+            except queue.Empty:
+                self.check_workers()
+                continue
+
+            if result is None: break
+
+            task_id, payload, error = result
+            with self.lock:
+                # Tasks of a dead worker have already failed...
+                task = self.task_dict.pop(task_id, None)
+                if task is None: continue
+
+                future, idx_slot, idx_worker = task
+                self.num_task_list[idx_worker] -= 1
+
+            # Copy the frame out of its slot before releasing the slot...
+            img = payload
+            if error is None and isinstance(payload, tuple):
+                shape, dtype = payload
+                img = np.ndarray(shape, dtype = dtype, buffer = self.slot_list[idx_slot].buf).copy()
+            if idx_slot is not None: self.slot_queue.put(idx_slot)
+
+            if error is None: future.set_result(img)
+            else            : future.set_exception(RuntimeError(error))
+
+        return None
+
+
+    def check_workers(self):
+        ''' Fail tasks in flight on workers that have exited.
+        '''
+        fail_list = []
+        with self.lock:
+            if self.is_closing: return None
+
+            for idx_worker, proc in enumerate(self.proc_list):
+                if self.is_dead_list[idx_worker] or proc.is_alive(): continue
+
+                self.is_dead_list[idx_worker] = True
+                print(f"Warning!!! Psana worker {idx_worker} exited with code {proc.exitcode}.")
+
+                for task_id, (future, idx_slot, idx_worker_task) in list(self.task_dict.items()):
+                    if idx_worker_task != idx_worker: continue
+
+                    del self.task_dict[task_id]
+                    self.num_task_list[idx_worker] -= 1
+                    fail_list.append((future, idx_slot, idx_worker))
+
+        for future, idx_slot, idx_worker in fail_list:
+            if idx_slot is not None: self.slot_queue.put(idx_slot)
+            future.set_exception(RuntimeError(f"Psana worker {idx_worker} exited before reading the event!!!"))
+
+        return None
+
+
+    def close(self):
+        # Refuse new tasks and fail those in flight, so that no caller waits on them...
+        with self.lock:
+            self.is_closing = True
+            fail_list = list(self.task_dict.values())
+            self.task_dict.clear()
+            self.num_task_list = [0] * self.num_procs
+
+        for future, idx_slot, idx_worker in fail_list:
+            if idx_slot is not None: self.slot_queue.put(idx_slot)
+            future.set_exception(RuntimeError("Psana worker pool closed before reading the event!!!"))
+
+        for task_queue in self.task_queue_list: task_queue.put(None)
+        for proc in self.proc_list: proc.join(timeout = 5)
+
+        self.result_queue.put(None)
+        self.collector.join(timeout = 5)
+
+        for slot in self.slot_list:
+            slot.close()
+            slot.unlink()
+        self.slot_list = []
+
+        return None
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import numpy as np
+
+
+class FakeReader:
+    """
+    A stand-in of PsanaImg without psana.  Each event is a frame filled with
+    its event number.  Opening and closing readers is appended to log when
+    it is given, each read takes delay seconds and reading exit_event ends
+    the process as a crashed worker would.  It is defined at module level so
+    that spawned workers can import it.
+    """
+
+    def __init__(self, exp, run, mode, detector_name, log = None, delay = 0.0, exit_event = None):
+        self.exp           = exp
+        self.run           = run
+        self.mode          = mode
+        self.detector_name = detector_name
+        self.log           = log
+        self.delay         = delay
+        self.exit_event    = exit_event
+
+        if self.log is not None: self.log.append(("open", exp, run))
+
+
+    def get(self, event_num, multipanel = None, mode = "image"):
+        if event_num == self.exit_event: os._exit(3)
+        if self.delay > 0: time.sleep(self.delay)
+
+        return np.full((4, 4), event_num, dtype = np.float32)
+
+
+    def close(self):
+        if self.log is not None: self.log.append(("close", self.exp, self.run))
+
+        return None
+
+
+
+
+class SlowReader(FakeReader):
+    """
+    A FakeReader taking a second per read, for managers that don't pass
+    reader arguments.
+    """
+
+    def __init__(self, exp, run, mode, detector_name, **kwargs):
+        kwargs.setdefault("delay", 1.0)
+        super().__init__(exp, run, mode, detector_name, **kwargs)
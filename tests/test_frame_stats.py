@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from hit_labeler.data import DataManager
+
+
+class ArrayManager(DataManager):
+    ''' Serve frames from an in-memory stack, logging each slab read.
+    '''
+
+    def __init__(self, config_data, imgs):
+        super().__init__(config_data)
+
+        self.imgs         = imgs
+        self.img_tag_list = list(range(len(imgs)))
+        self.slab_list    = []
+        self.MANAGER      = 'array'
+
+
+    def read_slab(self, group, start, stop):
+        self.slab_list.append((start, stop))
+        with self.timer.time("read"): slab = self.imgs[start:stop]
+
+        return slab
+
+
+    def fetch_img(self, idx):
+        return self.normalize_img(self.prepare_imgs([idx])[0], idx)
+
+
+    def prepare_imgs(self, idx_list):
+        return np.stack(self.read_grouped(idx_list, lambda idx: (None, idx), self.read_slab))
+
+
+def make_manager(stats_build):
+    config_data = type("Config", (), dict(prefetch_depth   = 0,
+                                           stats_build      = stats_build,
+                                           stats_batch_size = 4))()
+    imgs = np.random.default_rng(0).random((10, 8, 8), dtype = np.float32)
+
+    return ArrayManager(config_data, imgs)
+
+
+def test_no_store_without_stats_build(tmp_path):
+    manager = make_manager(stats_build = False)
+
+    assert manager.frame_stats is None
+    assert manager.get_norm_stats(manager.imgs[0], 0) is None
+    assert manager.get_levels(0) == (0, 1)
+
+    manager.save_stats(str(tmp_path / "stats.npz"))
+    assert not (tmp_path / "stats.npz").exists()
+    manager.close()
+
+
+def test_loaded_stats_are_used_without_stats_build(tmp_path):
+    path_stats = str(tmp_path / "stats.npz")
+
+    manager = make_manager(stats_build = True)
+    manager.build_stats()
+    manager.stats_thread.join()
+    assert manager.frame_stats.column_dict["mean"].dtype == np.float32
+    manager.save_stats(path_stats)
+    manager.close()
+
+    manager = make_manager(stats_build = False)
+    assert manager.load_stats(path_stats)
+    mean, std = manager.get_norm_stats(manager.imgs[3], 3)
+    assert np.isclose(mean, manager.imgs[3].mean(), rtol = 1e-5)
+    manager.close()
+
+
+def test_background_pass_is_not_timed():
+    manager = make_manager(stats_build = True)
+    manager.build_stats()
+    manager.stats_thread.join()
+
+    assert not manager.timer.get_percentiles()
+    assert not len(manager.frame_stats.get_missing())
+
+    manager.get_img(0)
+    assert "read" in manager.timer.get_percentiles()
+    manager.close()
+
+
+def test_background_pass_reads_one_frame_at_a_time():
+    manager = make_manager(stats_build = True)
+    manager.build_stats()
+    manager.stats_thread.join()
+    assert all( stop - start == 1 for start, stop in manager.slab_list )
+
+    # Displayed images are still read in slabs...
+    manager.slab_list.clear()
+    manager.prepare_imgs([0, 1, 2])
+    assert manager.slab_list == [(0, 3)]
+    manager.close()
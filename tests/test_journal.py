@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from hit_labeler.utils import LabelJournal
+
+
+def write_journal(path_journal, change_list):
+    journal = LabelJournal(path_journal)
+    journal.load()
+    journal.open()
+    journal.append(change_list)
+    journal.close()
+
+
+def test_append_after_torn_line_is_kept(tmp_path):
+    path_journal = str(tmp_path / "labels.jsonl")
+    write_journal(path_journal, [ (0, ("a", 0), "hit"), (1, ("a", 1), "miss") ])
+
+    # Leave half of a change behind as a crash would...
+    with open(path_journal, 'a') as fh: fh.write('{"idx": 2, "tag": ["a", 2], "la')
+
+    journal = LabelJournal(path_journal)
+    snapshot, change_list = journal.load()
+    assert [ idx for idx, tag, label in change_list ] == [0, 1]
+
+    journal.open()
+    journal.append([ (3, ("a", 3), "hit") ])
+    journal.close()
+
+    snapshot, change_list = LabelJournal(path_journal).load()
+    assert change_list == [ (0, ("a", 0), "hit"), (1, ("a", 1), "miss"), (3, ("a", 3), "hit") ]
+
+
+def test_open_without_load_ends_last_line(tmp_path):
+    path_journal = str(tmp_path / "labels.jsonl")
+    write_journal(path_journal, [ (0, ("a", 0), "hit") ])
+    with open(path_journal, 'a') as fh: fh.write('{"idx": 1')
+
+    journal = LabelJournal(path_journal)
+    journal.open()
+    journal.append([ (2, ("a", 2), "miss") ])
+    journal.close()
+
+    snapshot, change_list = LabelJournal(path_journal).load()
+    assert change_list == [ (0, ("a", 0), "hit"), (2, ("a", 2), "miss") ]
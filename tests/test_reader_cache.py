@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from hit_labeler.utils import PsanaReaderCache
+
+from fake_reader import FakeReader
+
+
+def make_cache(log, max_open = 2):
+    return PsanaReaderCache("idx", "fake", max_open      = max_open,
+                                           reader_class  = FakeReader,
+                                           reader_kwargs = dict(log = log))
+
+
+def test_get_reuses_open_reader():
+    log   = []
+    cache = make_cache(log)
+
+    reader = cache.get("exp", 1)
+    assert cache.get("exp", 1) is reader
+    assert log == [("open", "exp", 1)]
+
+
+def test_get_closes_least_recently_used_reader():
+    log   = []
+    cache = make_cache(log)
+
+    cache.get("exp", 1)
+    cache.get("exp", 2)
+    cache.get("exp", 1)
+    cache.get("exp", 3)
+
+    assert ("close", "exp", 2) in log
+    assert not ("close", "exp", 1) in log
+    assert list(cache.reader_dict) == [("exp", 1), ("exp", 3)]
+
+
+def test_evicted_run_is_opened_again():
+    log   = []
+    cache = make_cache(log, max_open = 1)
+
+    cache.get("exp", 1)
+    cache.get("exp", 2)
+    cache.get("exp", 1)
+
+    # A run is opened before the least recently used one is closed...
+    assert log == [("open", "exp", 1),
+                   ("open", "exp", 2), ("close", "exp", 1),
+                   ("open", "exp", 1), ("close", "exp", 2)]
+
+
+def test_read_returns_event_of_run():
+    cache = make_cache([])
+
+    img = cache.read("exp", 1, 7)
+    assert img.shape == (4, 4)
+    assert (img == 7).all()
+
+
+def test_close_all_closes_every_reader():
+    log   = []
+    cache = make_cache(log)
+
+    cache.get("exp", 1)
+    cache.get("exp", 2)
+    cache.close_all()
+
+    assert log[-2:] == [("close", "exp", 1), ("close", "exp", 2)]
+    assert not cache.reader_dict
@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from hit_labeler.utils import LocalityScheduler
+
+
+def test_order_sorts_numeric_runs_by_value():
+    tag_list  = [ ("exp", "10", 0), ("exp", "9", 5), ("exp", "9", 1), ("exp", "2", 3) ]
+    scheduler = LocalityScheduler(tag_list.__getitem__)
+
+    idx_list = scheduler.order(range(len(tag_list)))
+    assert [ tag_list[idx] for idx in idx_list ] == [ ("exp", "2", 3), ("exp", "9", 1), ("exp", "9", 5), ("exp", "10", 0) ]
+
+
+def test_order_keeps_named_runs_after_numeric_ones():
+    tag_list  = [ ("exp", "b", 0), ("exp", "a", 0), ("exp", 3, 0) ]
+    scheduler = LocalityScheduler(tag_list.__getitem__)
+
+    idx_list = scheduler.order(range(len(tag_list)))
+    assert [ tag_list[idx] for idx in idx_list ] == [ ("exp", 3, 0), ("exp", "a", 0), ("exp", "b", 0) ]
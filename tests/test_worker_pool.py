@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import pytest
+from concurrent.futures import TimeoutError
+
+from hit_labeler.data    import PsanaManager
+from hit_labeler.workers import PsanaWorkerPool
+
+from fake_reader import FakeReader, SlowReader
+
+
+def make_pool(**reader_kwargs):
+    return PsanaWorkerPool("idx", "fake", num_procs     = 1,
+                                          reader_class  = FakeReader,
+                                          reader_kwargs = reader_kwargs,
+                                          slot_nbytes   = 1024,
+                                          num_slots     = 2)
+
+
+def test_read_returns_event():
+    pool = make_pool()
+    try:
+        img = pool.read("exp", 1, 5)
+        assert (img == 5).all()
+    finally:
+        pool.close()
+
+
+def test_close_fails_tasks_in_flight():
+    pool = make_pool(delay = 1.0)
+    future_list = [ pool.submit("exp", 1, event_num) for event_num in range(2) ]
+    pool.close()
+
+    for future in future_list:
+        with pytest.raises(RuntimeError):
+            future.result(timeout = 1)
+
+
+def test_submit_after_close_raises():
+    pool = make_pool()
+    pool.close()
+
+    with pytest.raises(RuntimeError):
+        pool.submit("exp", 1, 0)
+
+
+def test_dead_worker_fails_its_tasks():
+    pool = make_pool(exit_event = 999)
+    try:
+        future = pool.submit("exp", 1, 999)
+        with pytest.raises(RuntimeError):
+            future.result(timeout = 10 * pool.POLL_INTERVAL + 10)
+
+        # No worker is left to take new tasks...
+        with pytest.raises(RuntimeError):
+            pool.submit("exp", 1, 0)
+    finally:
+        pool.close()
+
+
+def test_manager_close_stops_prefetching_reads(tmp_path):
+    path_csv = tmp_path / "events.csv"
+    path_csv.write_text("exp,run,event_num,label\n" + "".join(f"exp,1,{i},\n" for i in range(8)))
+
+    config_data = type("Config", (), dict(path_csv         = str(path_csv),
+                                           mode             = "idx",
+                                           detector         = "fake",
+                                           reader_class     = SlowReader,
+                                           num_procs        = 1,
+                                           prefetch_depth   = 4,
+                                           prefetch_workers = 2,
+                                           pyramid_bins     = (),
+                                           timing           = False))()
+    manager = PsanaManager(config_data)
+    manager.get_img(0)
+
+    # Leave prefetched reads waiting on the worker...
+    manager.prefetch(0)
+    with manager.prefetcher.lock: future_list = list(manager.prefetcher.future_dict.values())
+    assert future_list
+
+    time_start = time.perf_counter()
+    manager.close()
+    assert time.perf_counter() - time_start < 10
+
+    for future in future_list:
+        try:
+            future.result(timeout = 1)
+        except TimeoutError:
+            pytest.fail("A prefetched read still waits after close.")
+        except Exception:
+            pass